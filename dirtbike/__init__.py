@@ -2,31 +2,27 @@ from __future__ import (
     absolute_import, division, print_function, unicode_literals,
 )
 
+import io
 import os
+import sys
 import errno
-import atexit
-import shutil
-import tempfile
-import distutils.dist
-import wheel.bdist_wheel
-
-from distutils.command.install_egg_info import install_egg_info
-from glob import glob
-
-try:
-    from unittest.mock import patch
-except ImportError:
-    # Python 2.
-    from mock import patch
+import filecmp
 
+from .bytecode import bytecode_tag
+from .collector import warn_skipped
+from .context import METADATA_SUFFIXES
 from .strategy import (
     DpkgEggStrategy, DpkgImpStrategy, DpkgImportCalloutStrategy,
-    DpkgImportlibStrategy, WheelStrategy)
+    DpkgImportlibStrategy, MetadataStrategy, OtherPythonStrategy)
+from .timings import get_timings
+from .writer import (
+    COMPRESS_THREADS, DEFAULT_COMPRESSION, MAX_IN_FLIGHT_BYTES, UNIVERSAL,
+    WheelWriter)
 
 
 STRATEGIES = (
     # The order is significant here, so DO NOT sort alphabetically.
-    WheelStrategy,
+    MetadataStrategy,
     DpkgEggStrategy,
     DpkgImportlibStrategy,
     DpkgImpStrategy,
@@ -45,143 +41,258 @@ def _mkdir_p(dirname):
             raise
 
 
-def _copy_file_making_dirs_as_needed(src, dst):
-    _mkdir_p(os.path.dirname(dst))
-    shutil.copy(src, dst)
+def make_wheel_file(args):
+    """Rewheel ``args.package``, leaving the .whl in ``args.directory``.
 
+    Returns the path to the new .whl file.
+    """
+    return _make_wheel(
+        args.package, args.directory,
+        compression=getattr(args, 'compression', DEFAULT_COMPRESSION))
 
-def make_wheel_file(args):
-    distribution_name = args.package
+
+def _find_strategy(distribution_name, strategies=STRATEGIES, context=None,
+                   index=None):
     # Grab the metadata for the installed version of this distribution.
-    for strategy_class in STRATEGIES:
-        strategy = strategy_class(distribution_name)
+    for strategy_class in strategies:
+        strategy = strategy_class(distribution_name, context, index)
         if strategy.can_succeed:
-            break
-    else:
-        raise RuntimeError(
-            'No strategy for finding package contents: {}'.format(
-                distribution_name))
-
-    assert strategy.files is not None
-
-    # Create a Distribution object so that the wheel.bdist_wheel machinery can
-    # operate happily.  We copy any metadata we need out of the installed
-    # package metadata into this thing.
-    dummy_dist_distribution_obj = distutils.dist.Distribution(attrs={
-        'name': strategy.name,
-        'version': strategy.version,
-        })
-
-    # The wheel generator will clean up this directory when it exits, but
-    # let's just be sure that any failures don't leave this directory.
-    bdist_dir = tempfile.mkdtemp()
-    dist_dir = tempfile.mkdtemp()
-
-    if os.environ.get('DIRTBIKE_KEEP_TEMP'):
-        print('Keeping pre-zip staging directory', bdist_dir)
-        print('Keeping post-zip temporary directory', dist_dir)
-    else:
-        atexit.register(shutil.rmtree, bdist_dir, ignore_errors=True)
-        atexit.register(shutil.rmtree, dist_dir, ignore_errors=True)
-
-    wheel_generator = wheel.bdist_wheel.bdist_wheel(
-        dummy_dist_distribution_obj)
-    wheel_generator.universal = True
-    wheel_generator.bdist_dir = bdist_dir
-    wheel_generator.dist_dir = dist_dir
-
-    for filename in strategy.files:
-        # The list of files sometimes contains the empty string. That's not
-        # much of a file, so we don't bother adding it to the archive.
-        if len(filename) == 0:
-            continue
+            return strategy
+    raise RuntimeError(
+        'No strategy for finding package contents: {}'.format(
+            distribution_name))
 
-        # NOTE: If a file is not in the "location" that the installed package
-        # supposedly lives in, we skip it. This means we are likely to skip
-        # console scripts.
-        if filename.startswith('/'):
-            abspath = os.path.abspath(filename)
-        else:
-            abspath = os.path.abspath(
-                os.path.join(strategy.location, filename))
-
-        found = False
-        is_file = False
-        if abspath.startswith(strategy.location) and os.path.exists(abspath):
-            found = True
-            is_file = os.path.isfile(abspath)
-
-        # Print a warning in the case that some file is missing, then skip it.
-        if not found:
-            print('Skipping', abspath,
-                  'because we could not find it in the metadata location.')
-            continue
 
-        # Skip directories.
-        if found and not is_file:
-            continue
+def _ignore(path):
+    pass
 
-        # Skip the dist-info directory, since bdist_wheel will
-        # recreate it for us.
-        if '.dist-info' in abspath:
-            continue
 
-        # Skip any *.pyc files or files that are in a __pycache__ directory.
-        if '__pycache__' in abspath or abspath.endswith('.pyc'):
+def build_wheel(distribution_name, directory, strategies=STRATEGIES,
+                context=None, index=None, cache=None,
+                compression=DEFAULT_COMPRESSION, pool=None, skipped=None,
+                compile_level=None, compress_threads=COMPRESS_THREADS,
+                max_in_flight_bytes=MAX_IN_FLIGHT_BYTES, compile_pool=None):
+    """Rewheel `distribution_name`, leaving the .whl in `directory`.
+
+    Returns the path to the new .whl file.  Unlike `make_wheel_file()`,
+    this is meant to be called from long-running programs, from any number
+    of threads at once.  Nothing depends on the current directory, nothing
+    is printed, and nothing is left behind but the wheel.
+
+    The strategies in `strategies` are tried in order.  They look things up
+    in `context` and `index`, which default to the process-wide `Context`
+    and `DpkgIndex`.  If `cache` is given, it's the `WheelCache` to reuse
+    previously built wheels from.  `pool` is a `ThreadPool` in which to
+    hash the files, shared with other builds, rather than one started and
+    stopped for this build.  Files which can't go into the wheel are passed
+    to the `skipped` callback, if given.  If `compile_level` isn't None,
+    the wheel includes bytecode compiled at that optimization level.
+    `compress_threads`, `max_in_flight_bytes`, and `compile_pool` are as
+    for `WheelWriter`.
+    """
+    timings = get_timings()
+    timings.count('distributions')
+    with timings.phase('probe'):
+        strategy = _find_strategy(
+            distribution_name, strategies, context, index)
+    timings.count('strategy.{}'.format(type(strategy).__name__))
+    installed = strategy.collect(_ignore if skipped is None else skipped)
+    return _write_wheel(strategy, installed, directory, cache, compression,
+                        pool, compile_level,
+                        compress_threads=compress_threads,
+                        max_in_flight_bytes=max_in_flight_bytes,
+                        compile_pool=compile_pool)
+
+
+def _write_wheel(strategy, installed, directory, cache, compression, pool,
+                 compile_level, tags=UNIVERSAL,
+                 compress_threads=COMPRESS_THREADS,
+                 max_in_flight_bytes=MAX_IN_FLIGHT_BYTES, compile_pool=None):
+    timings = get_timings()
+    # Rather than staging the files in a temporary directory for
+    # bdist_wheel, stream them straight from their installed location into
+    # the wheel.  Any .egg-info or .dist-info files are passed along too.
+    # The writer turns them into the wheel's own .dist-info directory.
+    # Issue #19 describes what happens if we're careless about this: the
+    # entry_points.txt file doesn't survive into the wheel.
+    writer = WheelWriter(strategy.name, strategy.version, strategy.location,
+                         compression=compression, pool=pool, tags=tags,
+                         compile_level=compile_level,
+                         compress_threads=compress_threads,
+                         max_in_flight_bytes=max_in_flight_bytes,
+                         compile_pool=compile_pool,
+                         metadata_dir=strategy.metadata_dir)
+
+    _mkdir_p(directory)
+    if cache is None:
+        # The writer has to list all the files to sort them anyway, so let
+        # it find them.
+        writer.add_files(installed)
+        return writer.write(directory)
+    # The cache key covers every file, so they all have to be found first.
+    with timings.phase('collect'):
+        installed = list(installed)
+    writer.add_files(installed)
+    # If nothing has changed since we last built this wheel, just reuse it.
+    # $SOURCE_DATE_EPOCH is the wheel's timestamp, if it's set.  Every
+    # Python 3 on Debian shares the same installed files, and the same cache,
+    # but not the same bytecode.
+    options = [compression, '.'.join(tags),
+               os.environ.get('SOURCE_DATE_EPOCH', ''), compile_level,
+               '' if compile_level is None else bytecode_tag()]
+    with timings.phase('cache'):
+        key = cache.key(strategy, installed, options)
+        wheel = cache.get(key, writer.filename, directory)
+    if wheel is not None:
+        timings.count('cache_hits')
+        return wheel
+    timings.count('cache_misses')
+    wheel = writer.write(directory)
+    with timings.phase('cache'):
+        cache.put(key, wheel)
+    return wheel
+
+
+def _top_level_module(strategy, installed):
+    # Return the name of one of the distribution's top-level packages, or
+    # failing that, modules, or None if it has neither.  The metadata's
+    # top_level.txt says which they are.  Without one, any will do, except
+    # a test suite, which other distributions may have installed too.
+    packages = []
+    modules = []
+    listed = []
+    for info in installed:
+        parts = os.path.relpath(info.path, strategy.location).split(os.sep)
+        if parts[0].endswith(METADATA_SUFFIXES):
+            if parts[1:] == ['top_level.txt'] and (
+                    strategy.metadata_dir in (None, parts[0])):
+                with io.open(info.path, encoding='utf-8') as fp:
+                    listed = [line.strip() for line in fp]
             continue
+        if len(parts) == 2 and parts[1] == '__init__.py':
+            packages.append(parts[0])
+        elif len(parts) == 1 and parts[0].endswith('.py'):
+            modules.append(parts[0][:-len('.py')])
+    found = packages + modules
+    for name in listed + [name for name in found
+                          if name not in ('test', 'tests')]:
+        if name in found:
+            return name
+    return found[0] if len(found) > 0 else None
+
+
+def _comparable(strategy, installed):
+    # Map each file's path in the wheel to its `InstalledFile`.  The name of
+    # the metadata directory can differ between Pythons, e.g. Python 2's
+    # .egg-info may have a -py2.7 suffix, so only what's in it counts.
+    files = {}
+    for info in installed:
+        path = os.path.relpath(info.path, strategy.location)
+        top, sep, rest = path.partition(os.sep)
+        if top.endswith(METADATA_SUFFIXES):
+            path = os.path.join(METADATA_SUFFIXES[0], rest)
+        files[path] = info
+    return files
+
+
+def _same_files(strategy, installed, other, other_installed):
+    # Do the two installations have exactly the same files?  Only read them
+    # if there's no cheaper way to tell.
+    files = _comparable(strategy, installed)
+    other_files = _comparable(other, other_installed)
+    if set(files) != set(other_files):
+        return False
+    pairs = [(files[path], other_files[path]) for path in files]
+    if any(info.size != other_info.size for info, other_info in pairs):
+        return False
+    for info, other_info in pairs:
+        get_timings().count('bytes_compared', info.size)
+        if not filecmp.cmp(info.path, other_info.path, shallow=False):
+            return False
+    return True
+
+
+def _other_installation(strategy, installed, context, index, callout,
+                        skipped):
+    # Return the other Python's strategy and files, or (None, None) if it
+    # doesn't have its own installation.
+    module = _top_level_module(strategy, installed)
+    if module is None:
+        return None, None
+    other = OtherPythonStrategy(strategy.name, module, strategy.version,
+                                context, index, callout)
+    if not other.can_succeed or (
+            os.path.realpath(other.location)
+            == os.path.realpath(strategy.location)):
+        return None, None
+    return other, list(other.collect(skipped))
+
+
+def build_wheels(distribution_name, directory, strategies=STRATEGIES,
+                 context=None, index=None, cache=None,
+                 compression=DEFAULT_COMPRESSION, pool=None, skipped=None,
+                 compile_level=None, callout=None,
+                 compress_threads=COMPRESS_THREADS,
+                 max_in_flight_bytes=MAX_IN_FLIGHT_BYTES, compile_pool=None):
+    """Rewheel Python 2's and Python 3's installations of a distribution.
+
+    This interpreter's installation of `distribution_name` is found as for
+    `build_wheel()`, and the other's by importing one of its top-level
+    modules there, through `callout`, which defaults to the process-wide
+    `Callout`.  If the two have the same files, or there's no other
+    installation, one universal wheel is written.  Otherwise, there's a
+    wheel for each, tagged with its Python version.  Both installations
+    share this process's dpkg index, and are only read to compare them if
+    they have the same file names and sizes.
+
+    Returns the list of paths to the new wheels, Python 2's first.  The
+    other arguments are as for `build_wheel()`, except that only this
+    interpreter's wheel includes bytecode.
+    """
+    timings = get_timings()
+    timings.count('distributions')
+    skipped = _ignore if skipped is None else skipped
+    with timings.phase('probe'):
+        strategy = _find_strategy(
+            distribution_name, strategies, context, index)
+    timings.count('strategy.{}'.format(type(strategy).__name__))
+    with timings.phase('collect'):
+        installed = list(strategy.collect(skipped))
+    with timings.phase('other_python'):
+        other, other_installed = _other_installation(
+            strategy, installed, context, index, callout, skipped)
+        same = other is None or _same_files(
+            strategy, installed, other, other_installed)
+    threads = dict(compress_threads=compress_threads,
+                   max_in_flight_bytes=max_in_flight_bytes,
+                   compile_pool=compile_pool)
+    if same:
+        timings.count('universal_wheels')
+        return [_write_wheel(strategy, installed, directory, cache,
+                             compression, pool, compile_level, **threads)]
+    this_tag = 'py{}'.format(sys.version_info.major)
+    other_tag = 'py{}'.format(2 if sys.version_info.major == 3 else 3)
+    # This interpreter's bytecode would be no use to the other.
+    builds = {
+        this_tag: (strategy, installed, compile_level),
+        other_tag: (other, other_installed, None),
+        }
+    return [
+        _write_wheel(builds[tag][0], builds[tag][1], directory, cache,
+                     compression, pool, builds[tag][2], (tag,), **threads)
+        for tag in sorted(builds)
+        ]
+
 
-        _copy_file_making_dirs_as_needed(
-            abspath,
-            os.path.abspath(bdist_dir + '/' + filename))
-
-    # This is all a bit of a mess, but as they say "if it's
-    # distutils/setuptools, evil begets evil".  Here's what's going on.
-    #
-    # Issue #19 describes a problem where the entry_points.txt file doesn't
-    # survive from the .egg-info directory into the .dist-info directory in
-    # the resulting wheel.  This is because bdist_wheel called
-    # install_egg_info which first deletes the entire .egg-info directory!
-    #
-    # The only way to prevent this is to monkey patch install_egg_info so it
-    # doesn't run.  We already (probably) have a good .egg-info directory
-    # anyway, so it's not needed.
-    #
-    # This being distutils, there are of course complications.  First and
-    # easiest is that we might not have an .egg-info directory.  This can
-    # happen if we're rewheeling some stdlib package, e.g. ipaddress.  It can
-    # also happen in Debian for split packages, such as pkg_resources, which
-    # is really part of setuptools, but is provided in a separate .deb and
-    # doesn't have an .egg-info.
-    #
-    # But the bdist_wheel machinery *requires* an egg-info, so when it's
-    # missing, let the install_egg_info command actually run.  We don't care
-    # too much because we know there won't be an entry_points.txt file for the
-    # package, but it makes this stack of hack happy.
-    egg_infos = glob(os.path.join(bdist_dir, '*.egg-info'))
-    assert len(egg_infos) <= 1, egg_infos
-    wheel_generator.egginfo_dir = (
-        egg_infos[0] if len(egg_infos) > 0 else None)
-
-    # Call finalize_options() to tell bdist_wheel we are done playing with
-    # metadata.
-    wheel_generator.finalize_options()
-
-    # We can do this more elegantly when we're Python 3-only.
-    if wheel_generator.egginfo_dir is None:
-        wheel_generator.run()
-    else:
-        # Using mock's patch.object() is the most reliable way to monkey patch
-        # away the install-egg-info command.
-        with patch.object(install_egg_info, 'run'):
-            wheel_generator.run()
-
-    # Move the resulting .whl to its final destination.
-    files = glob(os.path.join(dist_dir, '{}*.whl'.format(distribution_name)))
-    assert len(files) == 1, files
-
-    destination = (
-        os.getcwd()
-        if args.directory is None
-        else args.directory)
-    _mkdir_p(destination)
-    shutil.move(files[0], destination)
+def _make_wheel(distribution_name, directory, cache=None,
+                compression=DEFAULT_COMPRESSION, both_pythons=False,
+                compile_level=None, compress_threads=COMPRESS_THREADS,
+                max_in_flight_bytes=MAX_IN_FLIGHT_BYTES, compile_pool=None):
+    # With `both_pythons`, this returns a list of wheels.
+    build = build_wheels if both_pythons else build_wheel
+    return build(
+        distribution_name,
+        os.getcwd() if directory is None else directory,
+        cache=cache, compression=compression, skipped=warn_skipped,
+        compile_level=compile_level, compress_threads=compress_threads,
+        max_in_flight_bytes=max_in_flight_bytes, compile_pool=compile_pool)
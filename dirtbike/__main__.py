@@ -1,7 +1,69 @@
+from __future__ import print_function
+
 import os
+import sys
+import json
+import signal
+import socket
 import argparse
 
-from . import make_wheel_file
+from . import server
+from .batch import build_many, read_package_file, site_distributions
+from .bytecode import OPTIMIZATION_LEVELS, check_level
+from .cache import DEFAULT_MAX_SIZE, WheelCache
+from .timings import get_timings
+from .writer import (
+    COMPRESS_THREADS, COMPRESSION, DEFAULT_COMPRESSION, MAX_IN_FLIGHT_BYTES,
+    source_date_epoch)
+
+
+def _check_environment(parser):
+    # Rather than failing every build with the same traceback.
+    try:
+        source_date_epoch()
+    except ValueError as error:
+        parser.error(str(error))
+
+
+def parse_serve_args(argv):
+    parser = argparse.ArgumentParser(
+        'dirtbike serve',
+        description="""Rewheel packages on behalf of dirtbike --socket
+        clients.  The installed packages and the dpkg database are only
+        scanned when something has been installed or removed, rather than
+        for every request.  Wheels are written by this process, so it must
+        be able to write to the clients' directories.  Only the user
+        running it can connect to the socket.""")
+    parser.add_argument('--socket', metavar='PATH', required=True,
+                        help="""Listen on the Unix socket PATH.""")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="""Rewheel up to N packages concurrently, in a
+                        pool of worker processes shared by all requests.  By
+                        default, each request is handled in its own thread,
+                        one package at a time.""")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('-j/--jobs must be at least 1')
+    _check_environment(parser)
+    return args
+
+
+def serve(argv):
+    args = parse_serve_args(argv)
+
+    def terminate(signum, frame):
+        sys.exit(0)
+    # Make sure the socket is cleaned up when we're told to stop.
+    signal.signal(signal.SIGTERM, terminate)
+    print('Serving on', args.socket, file=sys.stderr)
+    try:
+        server.serve(args.socket, args.jobs)
+    except KeyboardInterrupt:
+        pass
+    except server.DaemonError as error:
+        print(error, file=sys.stderr)
+        return 1
+    return 0
 
 
 def parseargs():
@@ -12,22 +74,206 @@ def parseargs():
                         directory.  If DIRECTORY doesn't exist, it will be
                         created.  This overrides $DIRTBIKE_DIRECTORY""",
                         default=os.environ.get('DIRTBIKE_DIRECTORY'))
-    parser.add_argument('package', nargs=1,
-                        help="""The name of the package to rewheel, as seen by
-                        Python (not your OS!).""")
+    parser.add_argument('-f', '--from-file', metavar='FILE',
+                        help="""Also rewheel the packages named in FILE, one
+                        per line.  Blank lines and lines starting with # are
+                        ignored.  Use - to read the names from standard
+                        input.""")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="""Rewheel up to N packages concurrently, in
+                        separate worker processes.  The default is to rewheel
+                        them one at a time.""")
+    parser.add_argument('--all', action='store_true',
+                        help="""Rewheel every installed package, leaving a
+                        complete wheelhouse in the directory.  Use -j to
+                        rewheel them in parallel.""")
+    parser.add_argument('--site', metavar='DIR',
+                        help="""With --all, only rewheel the packages
+                        installed in DIR, a site-packages or dist-packages
+                        directory.  DIR must be on sys.path, e.g. via
+                        $PYTHONPATH.""")
+    parser.add_argument('--with-deps', action='store_true',
+                        help="""Also rewheel every installed package that the
+                        named packages require, and everything those
+                        require, and so on.""")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="""Always build new wheels, rather than reusing
+                        previously built ones for packages which haven't
+                        changed.""")
+    parser.add_argument('--cache-size', type=int, metavar='MB',
+                        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help="""Keep at most MB megabytes of previously built
+                        wheels, evicting the least recently used ones.  The
+                        default is %(default)s.""")
+    parser.add_argument('--compression', choices=sorted(COMPRESSION),
+                        default=DEFAULT_COMPRESSION,
+                        help="""How hard to compress the wheels: not at all
+                        (stored), quickly (fast), zlib's default (default), or
+                        as small as possible (max).  If the wheels are about
+                        to be installed on the same host, stored is quickest.
+                        The default is %(default)s.""")
+    parser.add_argument('--compress-threads', type=int, metavar='N',
+                        default=COMPRESS_THREADS,
+                        help="""Compress each wheel's files in N threads,
+                        writing them into the wheel in the same order as
+                        they would be otherwise.  With the default of 0,
+                        they're compressed one at a time, as they're
+                        written.""")
+    parser.add_argument('--in-flight', type=int, metavar='MB',
+                        default=MAX_IN_FLIGHT_BYTES // (1024 * 1024),
+                        help="""With --compress-threads, hold at most MB
+                        megabytes of files in memory while they're being
+                        compressed or waiting to be written.  Bigger files
+                        are streamed into the wheel.  The default is
+                        %(default)s.""")
+    parser.add_argument('--both-pythons', action='store_true',
+                        help="""Also rewheel the other Python's installation of
+                        each package, e.g. python-foo's as well as
+                        python3-foo's, when running under Python 3.  If both
+                        have the same files, a single universal wheel is
+                        written, otherwise a py2 and a py3 wheel.""")
+    parser.add_argument('--compile', action='store_true',
+                        help="""Include bytecode in the wheels, compiled for
+                        this Python in parallel worker processes, so that
+                        they needn't be compiled on first import.""")
+    parser.add_argument('--optimize', type=int, choices=OPTIMIZATION_LEVELS,
+                        metavar='LEVEL',
+                        help="""With --compile, compile at optimization LEVEL,
+                        0, 1, or 2, as for python -O and -OO.  The default
+                        is 0.""")
+    parser.add_argument('--timings', action='store_true',
+                        help="""When done, print how long was spent in each
+                        phase of rewheeling, and counts of the files, bytes,
+                        and subprocesses involved, to standard error.""")
+    parser.add_argument('--timings-format', choices=('table', 'json'),
+                        default='table',
+                        help="""With --timings, print them as a table or as
+                        JSON.  The default is %(default)s.""")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="""Profile the run with cProfile, and save the
+                        stats to FILE, for use with the pstats module.  With
+                        -j, only the main process is profiled.""")
+    parser.add_argument('--socket', metavar='PATH',
+                        default=os.environ.get('DIRTBIKE_SOCKET'),
+                        help="""Rather than rewheeling the packages in this
+                        process, ask the dirtbike serve daemon listening on
+                        the Unix socket PATH to do it.  -j is then up to the
+                        daemon.  This overrides $DIRTBIKE_SOCKET.""")
+    parser.add_argument('package', nargs='*',
+                        help="""The names of the packages to rewheel, as seen
+                        by Python (not your OS!).""")
     parser.epilog = """\
 dirtbike also recognizes the environment variable $DIRTBIKE_DIRECTORY which if
 set, is used as the directory to put .whl files in.  This is analogous to the
--d/--directory option, although the command line switch takes precedence."""
-    return parser.parse_args()
+-d/--directory option, although the command line switch takes precedence.
+Similarly, $DIRTBIKE_SOCKET is the default for --socket.
+
+Run `dirtbike serve --help` to find out about running a dirtbike daemon.
+
+Information which is expensive to compute, such as an index of the dpkg
+database, and the wheels themselves, are cached between runs in
+$DIRTBIKE_CACHE_DIR, or if that is not set, $XDG_CACHE_HOME/dirtbike (by
+default ~/.cache/dirtbike)."""
+    args = parser.parse_args()
+    if args.from_file is not None:
+        if args.from_file == '-':
+            args.package.extend(read_package_file(sys.stdin))
+        else:
+            with open(args.from_file) as fp:
+                args.package.extend(read_package_file(fp))
+    if args.site is not None:
+        if not args.all:
+            parser.error('--site requires --all')
+    if args.socket is not None:
+        # The daemon finds out what's installed for --all.
+        if args.timings or args.profile is not None:
+            parser.error('--timings and --profile only work without --socket')
+    elif args.all:
+        try:
+            args.package.extend(site_distributions(args.site))
+        except ValueError as error:
+            parser.error(str(error))
+    if len(args.package) == 0 and not args.all:
+        parser.error('No packages to rewheel')
+    if args.jobs < 1:
+        parser.error('-j/--jobs must be at least 1')
+    _check_environment(parser)
+    if args.compress_threads < 0:
+        parser.error('--compress-threads must be at least 0')
+    if args.in_flight < 1:
+        parser.error('--in-flight must be at least 1')
+    if args.optimize is not None and not args.compile:
+        parser.error('--optimize requires --compile')
+    args.compile_level = None
+    if args.compile:
+        args.compile_level = 0 if args.optimize is None else args.optimize
+        try:
+            check_level(args.compile_level)
+        except ValueError as error:
+            parser.error(str(error))
+    return args
 
 
 def main():
+    if sys.argv[1:2] == ['serve']:
+        return serve(sys.argv[2:])
     args = parseargs()
-    # For convenience and readability of make_wheel_file().
-    args.package = args.package[0]
-    make_wheel_file(args)
+    cache = (
+        WheelCache(max_size=args.cache_size * 1024 * 1024)
+        if args.cache
+        else None)
+    if args.socket is not None:
+        try:
+            results = server.build(
+                args.socket, args.package, args.directory, args.cache,
+                args.cache_size * 1024 * 1024, args.with_deps,
+                args.compression, args.all, args.site, args.both_pythons,
+                args.compile_level, args.compress_threads,
+                args.in_flight * 1024 * 1024)
+        except (server.DaemonError, socket.error) as error:
+            print('dirtbike serve failed:', error, file=sys.stderr)
+            return 1
+    elif args.profile is None:
+        results = build_many(args.package, args.directory, args.jobs, cache,
+                             args.with_deps, args.compression,
+                             both_pythons=args.both_pythons,
+                             compile_level=args.compile_level,
+                             compress_threads=args.compress_threads,
+                             max_in_flight_bytes=args.in_flight * 1024 * 1024)
+    else:
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            results = profile.runcall(
+                build_many, args.package, args.directory, args.jobs, cache,
+                args.with_deps, args.compression,
+                both_pythons=args.both_pythons,
+                compile_level=args.compile_level,
+                compress_threads=args.compress_threads,
+                max_in_flight_bytes=args.in_flight * 1024 * 1024)
+        finally:
+            profile.dump_stats(args.profile)
+    if args.timings and args.timings_format == 'json':
+        json.dump(get_timings().as_dict(), sys.stderr, indent=2,
+                  sort_keys=True)
+        sys.stderr.write('\n')
+    elif args.timings:
+        sys.stderr.write(get_timings().format_table())
+    failures = [result for result in results if result.error is not None]
+    if len(results) == 1:
+        # Preserve the traditional single package behavior of just letting
+        # the traceback speak for itself.
+        if len(failures) > 0:
+            sys.stderr.write(failures[0].error)
+            return 1
+        return 0
+    print('Rewheeled {} of {} packages'.format(
+        len(results) - len(failures), len(results)))
+    for result in failures:
+        print('FAILED:', result.name, file=sys.stderr)
+        sys.stderr.write(result.error)
+    return 0 if len(failures) == 0 else 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""Rewheel many distributions in one invocation."""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import os
+import re
+import sys
+import traceback
+import multiprocessing
+
+from collections import deque, namedtuple
+
+from . import _find_strategy, _make_wheel
+from .bytecode import compile_pool as make_compile_pool
+from .context import get_context, normalize
+from .dpkg import DPKG_INFO_DIR, get_index
+from .timings import get_timings
+from .writer import COMPRESS_THREADS, DEFAULT_COMPRESSION, MAX_IN_FLIGHT_BYTES
+
+try:
+    from packaging.markers import Marker
+except ImportError:
+    Marker = None
+
+
+_REQUIREMENT_NAME = re.compile(r'\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+
+
+# The outcome of rewheeling a single distribution.  On success, `wheel` is the
+# path to the new .whl file (or when rewheeling both Pythons' installations,
+# a list of them) and `error` is None.  On failure, `wheel` is None
+# and `error` describes what went wrong.
+Result = namedtuple('Result', 'name wheel error')
+
+
+def _build_one(work):
+    # `options` are the keyword arguments for _make_wheel().
+    name, directory, cache, options = work
+    try:
+        return Result(
+            name, _make_wheel(name, directory, cache, **options), None)
+    except Exception:
+        # Don't let one bad distribution take down the whole batch.  The
+        # traceback is all we can usefully send back across the process
+        # boundary, since not every exception pickles.
+        return Result(name, None, traceback.format_exc())
+
+
+def _build_in_worker(work):
+    # The worker inherited whatever the parent had recorded before forking,
+    # so start afresh and send back only this build's timings.
+    timings = get_timings()
+    timings.reset()
+    return _build_one(work), timings.as_dict()
+
+
+def read_package_file(fp):
+    """Return the distribution names listed in an open file.
+
+    Names are given one per line.  Blank lines and lines starting with `#`
+    are ignored.
+    """
+    names = []
+    for line in fp:
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        names.append(line)
+    return names
+
+
+def _marker_matches(marker):
+    # Return whether the marker matches this interpreter, without any
+    # extras, or None if we can't tell.
+    if len(marker) == 0:
+        return True
+    if Marker is None:
+        # Without packaging, the best we can do is recognize requirements
+        # which only apply to extras.
+        return False if re.search(r'\bextra\b', marker) else None
+    try:
+        return Marker(marker).evaluate({'extra': ''})
+    except Exception:
+        return None
+
+
+def _dependencies(name):
+    # Yield the name of each distribution which `name` requires, and whether
+    # we're sure that it's required.
+    try:
+        strategy = _find_strategy(name)
+    except RuntimeError:
+        # The build itself will report this.
+        return
+    for requirement in strategy.requires:
+        requirement, semicolon, marker = requirement.partition(';')
+        match = _REQUIREMENT_NAME.match(requirement)
+        if match is None:
+            continue
+        matches = _marker_matches(marker.strip())
+        if matches is False:
+            continue
+        yield match.group(1), matches is True
+
+
+def preload():
+    """Load the process-wide lookup context and dpkg index now.
+
+    Do this before forking worker processes, so that they share them rather
+    than each scanning sys.path and reading the dpkg database themselves.
+    """
+    get_context().load()
+    if os.path.isdir(DPKG_INFO_DIR):
+        get_index().load()
+
+
+def fork_pool(processes):
+    """Return a pool of `processes` workers forked from this process.
+
+    The workers share whatever lookups were loaded before they were
+    forked, e.g. by `preload()`, which they wouldn't if they were spawned,
+    whatever the platform's default start method is.
+    """
+    if not hasattr(multiprocessing, 'get_context'):
+        # Python 2 always forks.
+        return multiprocessing.Pool(processes)
+    return multiprocessing.get_context('fork').Pool(processes)
+
+
+def fresh_pool(processes, initializer=None):
+    """Return a pool of `processes` workers which aren't forked.
+
+    This is for processes which may have threads, holding locks that a
+    forked worker would never see released.  The workers are started by a
+    fork server, or failing that spawned, and share nothing with this
+    process, so `initializer` is what loads their lookups, e.g.
+    `preload()`.  Python 2 can only fork.
+    """
+    if not hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.Pool(processes, initializer)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        'forkserver' if 'forkserver' in methods else 'spawn')
+    return context.Pool(processes, initializer)
+
+
+def site_distributions(site=None):
+    """Return the names of the distributions installed in `site`.
+
+    `site` is a site-packages or dist-packages directory, which must be on
+    sys.path, or ValueError is raised.  If it's None, return every installed
+    distribution.
+    """
+    if site is not None and not any(
+            os.path.realpath(entry or os.curdir) == os.path.realpath(site)
+            for entry in sys.path):
+        raise ValueError('{} is not on sys.path'.format(site))
+    names = []
+    for distribution in get_context().distributions():
+        if (site is not None and
+                os.path.realpath(distribution.location)
+                != os.path.realpath(site)):
+            continue
+        name = distribution.project_name
+        if name is None:
+            # Broken metadata; fall back to the name from the path.
+            name = os.path.basename(distribution.metadata_path).rsplit(
+                '.', 1)[0].split('-')[0]
+        names.append(name)
+    return names
+
+
+def build_many(names, directory=None, jobs=1, cache=None, with_deps=False,
+               compression=DEFAULT_COMPRESSION, pool=None,
+               both_pythons=False, compile_level=None,
+               compress_threads=COMPRESS_THREADS,
+               max_in_flight_bytes=MAX_IN_FLIGHT_BYTES, compile_pool=None):
+    """Rewheel every named distribution, leaving the wheels in `directory`.
+
+    `compression` is one of the keys of `dirtbike.writer.COMPRESSION`, and
+    says how the wheels' members are compressed.
+
+    If `both_pythons` is true, the other Python's installation of each
+    distribution is rewheeled too, as with `dirtbike.build_wheels()`, and
+    each `Result`'s `wheel` is a list of one or two wheels.
+
+    If `compile_level` isn't None, the wheels include bytecode compiled at
+    that optimization level.  Without a pool of workers, it's compiled in
+    `compile_pool`, a pool from `dirtbike.bytecode.compile_pool()`, or if
+    that's None, one started for this call and shared by all its wheels.
+    Otherwise, each worker compiles its wheels' bytecode itself.
+
+    Each wheel's files are compressed in `compress_threads` threads, holding
+    at most `max_in_flight_bytes` of them in memory, as for
+    `dirtbike.writer.WheelWriter`.
+
+    If `cache` is a `WheelCache`, wheels are reused from it whenever the
+    distribution hasn't changed since it was last rewheeled.
+
+    If `with_deps` is true, everything the named distributions require is
+    rewheeled too, and everything that requires, and so on.  Requirements
+    are read from the installed metadata, ignoring those for extras and
+    those whose markers don't match this interpreter.  A requirement whose
+    marker can't be evaluated is only followed if it's installed.
+
+    Up to `jobs` distributions are rewheeled concurrently, each in its own
+    worker process.  The pool is forked from this process after the lookup
+    context and dpkg index have been loaded, so every worker inherits them
+    rather than scanning sys.path and the dpkg database itself.  Workers are
+    reused across distributions for the same reason.
+
+    If `pool` is given, it's a `multiprocessing.Pool` to use rather than
+    creating one, in which case `jobs` is ignored.  It's up to the caller to
+    load the lookups before creating it, and to close it afterwards.
+
+    Building a wheel never needs the wheels of its dependencies, so the
+    dependency graph only decides what gets built, not when.  Each
+    distribution is handed to the pool as soon as it's discovered, while
+    this process carries on walking the graph, so idle workers never wait
+    for the whole closure to be resolved.
+
+    Whichever process does the work, the timings of every build end up in
+    this process's `get_timings()`.
+
+    Returns a list of `Result` objects, for the named distributions in the
+    same order as `names`, followed by their dependencies in breadth first
+    order.  Each distribution is only rewheeled once, however many times
+    it's named or required.
+    """
+    queue = deque((name, True) for name in names)
+    own_pool = None
+    if pool is None and jobs > 1 and (with_deps or len(set(names)) > 1):
+        preload()
+        pool = own_pool = fork_pool(
+            jobs if with_deps else min(jobs, len(set(names))))
+    options = dict(compression=compression, both_pythons=both_pythons,
+                   compile_level=compile_level,
+                   compress_threads=compress_threads,
+                   max_in_flight_bytes=max_in_flight_bytes)
+    own_compile_pool = None
+    if pool is None and compile_level is not None:
+        # The wheels are built in this process, and can share a pool.
+        if compile_pool is None:
+            compile_pool = own_compile_pool = make_compile_pool()
+        options['compile_pool'] = compile_pool
+    seen = set()
+    # Either `Result`s, or the pool's promises of them.
+    pending = []
+    try:
+        while len(queue) > 0:
+            name, required = queue.popleft()
+            key = normalize(name)
+            if key in seen:
+                continue
+            if not required and get_context().distribution(name) is None:
+                continue
+            seen.add(key)
+            work = (name, directory, cache, options)
+            if pool is None:
+                pending.append(_build_one(work))
+            else:
+                pending.append(pool.apply_async(_build_in_worker, (work,)))
+            if with_deps:
+                queue.extend(_dependencies(name))
+        results = []
+        for result in pending:
+            if not isinstance(result, Result):
+                result, timings = result.get()
+                get_timings().merge(timings)
+            results.append(result)
+        return results
+    finally:
+        if own_pool is not None:
+            own_pool.close()
+            own_pool.join()
+        if own_compile_pool is not None:
+            own_compile_pool.terminate()
+            own_compile_pool.join()
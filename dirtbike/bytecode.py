@@ -0,0 +1,177 @@
+"""Byte-compile a wheel's sources, so that they needn't be on first import."""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import os
+import sys
+import shutil
+import tempfile
+import py_compile
+import multiprocessing
+
+from .timings import get_timings
+
+try:
+    from importlib.util import cache_from_source
+except ImportError:
+    # Python 2.
+    cache_from_source = None
+
+try:
+    from py_compile import PycInvalidationMode
+except ImportError:
+    # Before Python 3.7, there are only timestamp based .pyc files.
+    PycInvalidationMode = None
+
+
+OPTIMIZATION_LEVELS = (0, 1, 2)
+
+
+def compiled_name(arcname, level=0):
+    """Return where the bytecode for the source `arcname` goes in the wheel.
+
+    That's in a __pycache__ directory, tagged for this interpreter and
+    optimization `level`, or for Python 2, next to the source.
+    """
+    if cache_from_source is None:
+        return arcname + ('c' if level == 0 else 'o')
+    return cache_from_source(
+        arcname, optimization='' if level == 0 else level)
+
+
+def bytecode_tag():
+    """Return the name of this interpreter's bytecode format.
+
+    That's e.g. cpython-312, which is in the names of its .pyc files.  No
+    other interpreter can load them.
+    """
+    if cache_from_source is None:
+        # Python 2.
+        return 'python{}.{}'.format(*sys.version_info[:2])
+    return sys.implementation.cache_tag
+
+
+def check_level(level):
+    """Raise ValueError unless this interpreter can compile at `level`."""
+    if level not in OPTIMIZATION_LEVELS:
+        raise ValueError('Unknown optimization level: {}'.format(level))
+    if sys.version_info.major == 2 and level != 0:
+        raise ValueError('Python 2 can only compile at level 0')
+
+
+def compile_pool(processes=None):
+    """Return a pool of `processes` workers for `Compiler`s to share.
+
+    By default there's one per CPU.  The workers are started by a fork
+    server, or failing that spawned, rather than forked from this process,
+    which may have threads holding locks that a forked child would never
+    see released.  Before Python 3.4 they have to be forked anyway.
+    """
+    if not hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.Pool(processes)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        'forkserver' if 'forkserver' in methods else 'spawn')
+    return context.Pool(processes)
+
+
+def _compile(job):
+    # Run in the worker processes.  Return whether `source` compiled.
+    source, target, dfile, level = job
+    kws = {}
+    if sys.version_info.major >= 3:
+        kws['optimize'] = level
+    if PycInvalidationMode is not None:
+        # Installers don't keep the sources' modification times, so a
+        # timestamp based .pyc would look stale as soon as it was installed.
+        # The source's hash is the same wherever it ends up.
+        kws['invalidation_mode'] = PycInvalidationMode.CHECKED_HASH
+    try:
+        py_compile.compile(source, target, dfile, doraise=True, **kws)
+    except py_compile.PyCompileError:
+        # Most likely Python 2 only code, which Debian still ships.
+        return False
+    return True
+
+
+class Compiler(object):
+    """Byte-compile sources in the background, in a pool of processes.
+
+    `level` is the optimization level, as for `python -O`.  Python 2 can
+    only compile at its own level, which is 0 unless it was started with
+    -O.  `pool` is a pool from `compile_pool()`, shared with other
+    compilers and left running.  Without one, a pool of `processes`
+    workers is started for this compiler alone, except in a `build_many()`
+    worker, which can't have worker processes of its own, and compiles in
+    the foreground instead.
+    """
+
+    def __init__(self, level=0, processes=None, pool=None):
+        check_level(level)
+        self.level = level
+        self.processes = processes
+        self._directory = None
+        self._shared_pool = pool
+        self._pool = None
+        self._pending = None
+        self._compiled = []
+
+    def start(self, sources):
+        """Start compiling `sources`, a list of (arcname, path) pairs."""
+        self._directory = tempfile.mkdtemp(prefix='dirtbike-')
+        jobs = []
+        for arcname, path in sources:
+            name = compiled_name(arcname, self.level)
+            target = os.path.join(self._directory, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            # Tracebacks show the source's path in the wheel, since where
+            # it'll be installed is anybody's guess.
+            jobs.append((path, target, arcname, self.level))
+            self._compiled.append((name, target))
+        pool = self._shared_pool
+        if pool is None and len(jobs) >= 2 and (
+                not multiprocessing.current_process().daemon):
+            pool = self._pool = compile_pool(self.processes)
+        if len(jobs) < 2 or pool is None:
+            with get_timings().phase('compile'):
+                self._pending = [_compile(job) for job in jobs]
+        else:
+            self._pending = pool.map_async(
+                _compile, jobs, chunksize=max(1, len(jobs) // 64))
+
+    def results(self):
+        """Wait for the compiler, and return the bytecode files it wrote.
+
+        These are (arcname, path) pairs, in the same order as the sources
+        they were compiled from.  Sources which wouldn't compile are left
+        out.
+        """
+        timings = get_timings()
+        if isinstance(self._pending, list):
+            # Compiled in the foreground, by start().
+            compiled = self._pending
+        else:
+            with timings.phase('compile'):
+                compiled = self._pending.get()
+        results = []
+        for (name, target), ok in zip(self._compiled, compiled):
+            if ok:
+                results.append((name, target))
+            else:
+                timings.count('compile_failures')
+        timings.count('compiled', len(results))
+        return results
+
+    def close(self):
+        """Stop this compiler's own workers, and remove the bytecode files."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
@@ -0,0 +1,203 @@
+"""Where dirtbike keeps things between runs."""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import os
+import uuid
+import errno
+import shutil
+import hashlib
+
+from .timings import get_timings
+
+try:
+    import fcntl
+except ImportError:
+    # Not a Unix.
+    fcntl = None
+
+
+# Bump this whenever a change to dirtbike changes the wheels it builds from
+# the same files, so that old cached wheels aren't reused.
+CACHE_FORMAT = 4
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+# The ioctl for making a copy-on-write clone of a file, from linux/fs.h.
+FICLONE = 0x40049409
+
+
+def cache_dir():
+    """Return the directory dirtbike caches things in.
+
+    This is $DIRTBIKE_CACHE_DIR if it's set, otherwise the dirtbike directory
+    under $XDG_CACHE_HOME (which defaults to ~/.cache).  The directory is not
+    guaranteed to exist.
+    """
+    path = os.environ.get('DIRTBIKE_CACHE_DIR')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'dirtbike')
+
+
+def _clone(src, dst):
+    # Make dst a copy of src, as cheaply as possible, returning how.  On file
+    # systems which support it, such as btrfs and XFS, a reflink shares the
+    # data blocks until either file is modified.  Failing that,
+    # copy_file_range() at least keeps the copy in the kernel, and some file
+    # systems do it without copying anything either.
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return 'reflink'
+            except (IOError, OSError):
+                pass
+        copy_file_range = getattr(os, 'copy_file_range', None)
+        if copy_file_range is not None:
+            try:
+                while copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), 1024 * 1024 * 1024) > 0:
+                    pass
+                return 'copy_file_range'
+            except OSError:
+                # Start again from the top.
+                os.lseek(fsrc.fileno(), 0, os.SEEK_SET)
+                os.lseek(fdst.fileno(), 0, os.SEEK_SET)
+                fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+        return 'copy'
+
+
+def _link_or_copy(src, dst):
+    # Hard link if we can, since wheels are never modified in place, and
+    # fall back to the cheapest kind of copy we can make, e.g. across file
+    # systems.  Either way, do it under a temporary name so that nobody sees
+    # a partial file.  Returns which of 'hardlink', 'reflink',
+    # 'copy_file_range', or 'copy' it was.
+    tmpfile = os.path.join(
+        os.path.dirname(dst),
+        '.{}.{}'.format(uuid.uuid4().hex, os.path.basename(dst)))
+    try:
+        os.link(src, tmpfile)
+        mode = 'hardlink'
+    except OSError:
+        try:
+            mode = _clone(src, tmpfile)
+        except BaseException:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            raise
+    try:
+        os.rename(tmpfile, dst)
+    finally:
+        # If dst was already a link to src, POSIX says rename() does nothing
+        # at all, so the temporary file is still there.
+        if os.path.lexists(tmpfile):
+            os.remove(tmpfile)
+    get_timings().count('copied_by.{}'.format(mode))
+    return mode
+
+
+class WheelCache(object):
+    """Built wheels, keyed on everything that goes into them.
+
+    Rewheeling an OS package which hasn't changed since the last time gives
+    the same wheel, so rather than building it all over again, link or copy
+    the one we built last time.  The cache is kept under `max_size` bytes by
+    evicting the least recently used wheels.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = (
+            os.path.join(cache_dir(), 'wheels')
+            if directory is None
+            else directory)
+        self.max_size = max_size
+
+    def key(self, strategy, installed, options=()):
+        """Return the cache key for a wheel.
+
+        The key covers the distribution's name and version, the strategy
+        which found its files, and the path, size, and modification time of
+        every one of those files, which are given by the `InstalledFile`s in
+        `installed`.  `options` is anything else which changes
+        the wheel, such as how it's compressed.  If any of them change, so
+        does the key.
+        """
+        digest = hashlib.sha256()
+        parts = [CACHE_FORMAT, strategy.name, strategy.version,
+                 type(strategy).__name__, strategy.location]
+        parts.extend(options)
+        for part in parts:
+            digest.update('{}\0'.format(part).encode('utf-8'))
+        for info in installed:
+            digest.update('{}\0{}\0{}\0'.format(
+                info.path, info.size, info.mtime).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key, filename, destination):
+        """Put the cached wheel in `destination`, returning its path.
+
+        Returns None if the wheel isn't cached.
+        """
+        cached = os.path.join(self.directory, key, filename)
+        wheel = os.path.join(destination, filename)
+        try:
+            _link_or_copy(cached, wheel)
+        except (IOError, OSError) as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return None
+        # Cache hits count as uses for the purposes of eviction.
+        try:
+            os.utime(os.path.join(self.directory, key), None)
+        except OSError:
+            pass
+        return wheel
+
+    def put(self, key, wheel):
+        """Add a newly built wheel to the cache."""
+        entry = os.path.join(self.directory, key)
+        try:
+            try:
+                os.makedirs(entry)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+            _link_or_copy(wheel, os.path.join(entry, os.path.basename(wheel)))
+            self.evict()
+        except (IOError, OSError):
+            # Not being able to cache the wheel shouldn't stop us.
+            pass
+
+    def evict(self):
+        """Remove the least recently used wheels until we're under size."""
+        entries = []
+        total = 0
+        try:
+            keys = os.listdir(self.directory)
+        except OSError:
+            return
+        for key in keys:
+            entry = os.path.join(self.directory, key)
+            size = 0
+            try:
+                # Something else could be evicting the same entry.
+                mtime = os.stat(entry).st_mtime
+                for filename in os.listdir(entry):
+                    size += os.stat(os.path.join(entry, filename)).st_size
+            except OSError:
+                continue
+            entries.append((mtime, key, size))
+            total += size
+        for mtime, key, size in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(os.path.join(self.directory, key),
+                          ignore_errors=True)
+            total -= size
@@ -0,0 +1,202 @@
+"""Ask the other Python interpreter where its modules are.
+
+Some distributions are only installed for the other major version of
+Python, so the only way to find them is to import them there.  Rather than
+spawning an interpreter for every one, a single helper process is started
+the first time it's needed and then kept running, answering one question
+per line over a pipe, until the run (or the daemon's session) is over.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import os
+import sys
+import json
+import threading
+import subprocess
+
+from .timings import get_timings
+from collections import namedtuple
+
+
+OTHER_PYTHON = '/usr/bin/python{}'.format(
+    2 if sys.version_info.major == 3 else 3)
+
+# This runs in the other interpreter, which may be Python 2 or 3.  It reads a
+# module name per line and writes back a JSON object per line, with either
+# the module's __file__ or the traceback of whatever went wrong.  Anything the
+# imported modules read or print themselves is kept away from the pipes.
+HELPER = r"""
+import os, sys, json, signal, traceback
+from importlib import import_module
+requests = os.fdopen(os.dup(0), 'r')
+responses = os.fdopen(os.dup(1), 'w')
+os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+os.dup2(2, 1)
+sys.stdin = open(os.devnull)
+sys.stdout = sys.stderr
+# Interrupting dirtbike closes the pipe, which is how we know to exit.
+signal.signal(signal.SIGINT, signal.SIG_IGN)
+while True:
+    name = requests.readline()
+    if len(name) == 0:
+        break
+    try:
+        response = dict(file=import_module(name.strip()).__file__)
+    except BaseException:
+        response = dict(error=traceback.format_exc())
+    responses.write(json.dumps(response) + '\n')
+    responses.flush()
+"""
+
+
+class CalloutError(Exception):
+    """The helper process couldn't be started."""
+
+
+# What the other interpreter said about a module.  If it could be imported,
+# `file` is its __file__, which may be None, e.g. for namespace packages, and
+# `error` is None.  Otherwise `file` is None and `error` says why.
+Answer = namedtuple('Answer', 'file error')
+
+
+class Callout(object):
+    """A helper process running in the interpreter `python`.
+
+    Any number of threads may ask it questions at once, and answers are
+    remembered, since the helper can't unimport anything anyway.
+    """
+
+    def __init__(self, python=OTHER_PYTHON):
+        self.python = python
+        self.pid = os.getpid()
+        self._process = None
+        self._failure = None
+        self._closed = False
+        self._answers = {}
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # A thread still holding on to a helper that's been reset mustn't
+        # start another, since nothing would ever stop it.
+        if self._closed:
+            raise CalloutError('The helper has been closed')
+        # Most likely, there is no other interpreter, and there's no point
+        # looking for it again.
+        if self._failure is not None:
+            raise CalloutError(self._failure)
+        get_timings().count('subprocesses')
+        try:
+            self._process = subprocess.Popen(
+                [self.python, '-c', HELPER],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                close_fds=True)
+        except OSError as error:
+            self._failure = 'Cannot run {}: {}'.format(self.python, error)
+            raise CalloutError(self._failure)
+
+    def _stop(self):
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+        except (IOError, OSError):
+            # Flushing to a dead helper fails.
+            pass
+        process.stdout.close()
+        return process.wait()
+
+    def find(self, names):
+        """Return an `Answer` for each of the module names in `names`.
+
+        All the questions are sent before any answers are read, so a batch
+        of them costs no more round trips than a single one.  Raises
+        CalloutError if the helper can't be started.  If it dies, the
+        answers it didn't give are errors, which aren't remembered, and the
+        next question starts a new helper.
+        """
+        names = list(names)
+        with self._lock:
+            questions = []
+            for name in names:
+                if name not in self._answers and name not in questions:
+                    questions.append(name)
+            answers = self._ask(questions) if len(questions) > 0 else {}
+            return [self._answers.get(name, answers.get(name))
+                    for name in names]
+
+    def _ask(self, names):
+        # Called with the lock held.  Return the answers to every question,
+        # remembering those that weren't cut short.
+        answers = {}
+        for name in names:
+            if '\n' in name:
+                # This would throw the helper's answers out of step.
+                answers[name] = Answer(None, 'Not a module name')
+        names = [name for name in names if name not in answers]
+        if len(names) == 0:
+            return answers
+        if self._process is None:
+            self._start()
+        get_timings().count('callouts', len(names))
+        try:
+            self._process.stdin.write(b''.join(
+                name.encode('utf-8') + b'\n' for name in names))
+            self._process.stdin.flush()
+        except (IOError, OSError):
+            # It's died, which reading the answers will tell us.
+            pass
+        for name in names:
+            line = self._process.stdout.readline()
+            if len(line) == 0:
+                error = '{} exited with status {}'.format(
+                    self.python, self._stop())
+                for unanswered in names:
+                    answers.setdefault(unanswered, Answer(None, error))
+                break
+            response = json.loads(line.decode('utf-8'))
+            answers[name] = self._answers[name] = Answer(
+                response.get('file'), response.get('error'))
+        return answers
+
+    def close(self):
+        """Stop the helper, if it's running, and don't start another.
+
+        After this, questions which haven't already been answered raise
+        CalloutError.
+        """
+        with self._lock:
+            self._closed = True
+            if self._process is not None:
+                self._stop()
+
+
+_callout = None
+_callout_lock = threading.Lock()
+
+
+def reset_callout():
+    """Stop the process-wide helper, so the next one starts afresh.
+
+    The helper has imported everything it's been asked about, so this is
+    the only way to find out about anything reinstalled since.  Anything
+    still using the old helper can't start it up again.
+    """
+    global _callout
+    with _callout_lock:
+        callout, _callout = _callout, None
+    if callout is not None and callout.pid == os.getpid():
+        callout.close()
+
+
+def get_callout():
+    """Return the process-wide helper, creating it if necessary."""
+    global _callout
+    with _callout_lock:
+        # Forked worker processes mustn't share their parent's pipes, so each
+        # gets its own helper.
+        if _callout is None or _callout.pid != os.getpid():
+            _callout = Callout()
+        return _callout
@@ -0,0 +1,69 @@
+"""Decide which of a distribution's files go into its wheel."""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import os
+import stat
+
+from .timings import get_timings
+from collections import namedtuple
+
+
+# A file which is going into the wheel, along with what stat'ing it told us,
+# so that nothing after the collector has to stat it again.
+InstalledFile = namedtuple('InstalledFile', 'path size mtime mode')
+
+
+def installed_file(path):
+    """Stat `path` and return its `InstalledFile`."""
+    info = os.stat(path)
+    return InstalledFile(path, info.st_size, info.st_mtime, info.st_mode)
+
+
+def warn_skipped(path):
+    """Print a warning that `path` isn't going into the wheel."""
+    print('Skipping', path,
+          'because we could not find it in the metadata location.')
+
+
+def collect(filenames, location, skipped=warn_skipped):
+    """Generate an `InstalledFile` for each of `filenames` worth wheeling.
+
+    `filenames` is any iterable of paths relative to `location`, or
+    absolute, and is consumed lazily, one file at a time.  Each is stat'ed
+    exactly once.  Files outside `location`, such as console scripts, and
+    files which don't exist are skipped, and their absolute paths are passed
+    to the `skipped` callback, which by default prints a warning.  Directories,
+    bytecode, and anything in a __pycache__ directory are silently skipped.
+    Metadata is kept, since the writer turns it into the wheel's own
+    .dist-info directory.
+    """
+    timings = get_timings()
+    for filename in filenames:
+        # The list of files sometimes contains the empty string.  That's not
+        # much of a file, so we don't bother adding it to the archive.
+        if len(filename) == 0:
+            continue
+        timings.count('files_considered')
+        # join() ignores the location for absolute paths.
+        path = os.path.abspath(os.path.join(location, filename))
+        # Skip any *.pyc files or files that are in a __pycache__ directory,
+        # before going to the trouble of stat'ing them.
+        if '__pycache__' in path or path.endswith('.pyc'):
+            continue
+        info = None
+        if path.startswith(location):
+            try:
+                info = os.stat(path)
+            except OSError:
+                pass
+        if info is None:
+            skipped(path)
+            timings.count('files_skipped')
+            continue
+        if not stat.S_ISREG(info.st_mode):
+            continue
+        yield InstalledFile(path, info.st_size, info.st_mtime, info.st_mode)
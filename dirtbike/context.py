@@ -0,0 +1,394 @@
+"""Distribution and module lookups shared by all the strategies."""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import io
+import os
+import re
+import csv
+import sys
+import email
+import threading
+
+from .timings import get_timings
+from collections import namedtuple
+
+try:
+    import pathlib
+    from importlib import metadata as importlib_metadata
+except ImportError:
+    # Python 2, or Python 3 before 3.8, where we have to fall back to
+    # pkg_resources.
+    importlib_metadata = None
+
+
+# Module file suffixes, in order of preference.  This isn't quite the import
+# system's order, since we're not importing anything.  What we care about is
+# finding the file which dpkg owns, and that's the source, not the bytecode.
+try:
+    from importlib.machinery import (
+        BYTECODE_SUFFIXES, EXTENSION_SUFFIXES, SOURCE_SUFFIXES)
+    SUFFIXES = SOURCE_SUFFIXES + EXTENSION_SUFFIXES + BYTECODE_SUFFIXES
+except ImportError:
+    # Python 2.
+    import imp
+    SUFFIXES = [
+        suffix
+        for kind in (imp.PY_SOURCE, imp.C_EXTENSION, imp.PY_COMPILED)
+        for suffix, mode, suffix_kind in imp.get_suffixes()
+        if suffix_kind == kind
+        ]
+
+
+def _list_directory(directory):
+    # Return the sorted names of the entries in `directory`, each with
+    # whether it's a directory, or None if we can't tell without stat'ing it.
+    # scandir() usually gets that from the directory entry itself.
+    try:
+        scandir = os.scandir
+    except AttributeError:
+        # Python 2, or Python 3 before 3.5.
+        return [(name, None) for name in sorted(os.listdir(directory))]
+    entries = []
+    iterator = scandir(directory)
+    try:
+        for entry in iterator:
+            entries.append((entry.name, entry.is_dir()))
+    finally:
+        # Before Python 3.6 the iterator isn't a context manager.
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+    return sorted(entries)
+
+
+# A top-level module found on sys.path.  `path` is the package directory for
+# packages, or the module file otherwise.
+Module = namedtuple('Module', 'name path is_package')
+
+METADATA_SUFFIXES = ('.dist-info', '.egg-info')
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def normalize(name):
+    """Normalize a distribution name, as per PEP 503."""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+class InstalledDistribution(object):
+    """An installed distribution.
+
+    `metadata_path` is its .dist-info or .egg-info directory (or for some
+    distutils projects, its .egg-info file), and `location` is the site
+    directory containing that.
+    """
+
+    def __init__(self, metadata_path):
+        self.metadata_path = metadata_path
+        self.location = os.path.dirname(metadata_path)
+
+    @property
+    def project_name(self):
+        """The project's name, according to its metadata."""
+        raise NotImplementedError
+
+    @property
+    def version(self):
+        """The installed version."""
+        raise NotImplementedError
+
+    def read(self, name):
+        """Return the contents of the named metadata file, or None."""
+        raise NotImplementedError
+
+    def requires(self):
+        """Return the distribution's requirements.
+
+        These are PEP 508 requirement strings, e.g. `six>=1.9; python_version
+        >= "3"`, including those of every extra.  Markers are not evaluated.
+        """
+        raise NotImplementedError
+
+    def has(self, name):
+        """Is there a metadata file with the given name?"""
+        return os.path.isfile(os.path.join(self.metadata_path, name))
+
+    def _open(self, name):
+        # Open a metadata file to read line by line, or return None.  In
+        # Python 2, the csv module only understands bytes.
+        path = os.path.join(self.metadata_path, name)
+        if not os.path.isfile(path):
+            return None
+        if sys.version_info.major == 2:
+            return open(path, 'rb')
+        return io.open(path, encoding='utf-8', newline='')
+
+    def _iter_record(self, fp):
+        with fp:
+            for row in csv.reader(fp):
+                if len(row) > 0:
+                    yield _text(row[0])
+
+    def _iter_installed_files(self, fp):
+        with fp:
+            for line in fp:
+                filename = _text(line).rstrip('\r\n')
+                if len(filename) == 0:
+                    continue
+                # These are relative to the .egg-info directory, not the
+                # location.
+                yield os.path.relpath(
+                    os.path.join(self.metadata_path, filename), self.location)
+
+    def iter_files(self):
+        """Return an iterator over the installed files, or None.
+
+        Relative paths are relative to `location`.  This comes from the
+        RECORD of distributions installed from wheels, or the
+        installed-files.txt of those pip installed from source, which is
+        read as the iterator is consumed rather than all at once.
+        """
+        fp = self._open('RECORD')
+        if fp is not None:
+            return self._iter_record(fp)
+        fp = self._open('installed-files.txt')
+        if fp is not None:
+            return self._iter_installed_files(fp)
+        return None
+
+    def files(self):
+        """Return the list of installed files, or None.
+
+        See `iter_files()`.
+        """
+        files = self.iter_files()
+        return None if files is None else list(files)
+
+
+class _ImportlibDistribution(InstalledDistribution):
+    def __init__(self, metadata_path):
+        super(_ImportlibDistribution, self).__init__(metadata_path)
+        self._distribution = importlib_metadata.PathDistribution(
+            pathlib.Path(metadata_path))
+        self._headers = None
+
+    @property
+    def _metadata(self):
+        if self._headers is None:
+            if os.path.isfile(self.metadata_path):
+                # importlib.metadata doesn't understand .egg-info files.
+                with open(self.metadata_path, encoding='utf-8') as fp:
+                    self._headers = email.message_from_file(fp)
+            else:
+                self._headers = self._distribution.metadata
+        return self._headers
+
+    @property
+    def project_name(self):
+        return self._metadata['Name']
+
+    @property
+    def version(self):
+        return self._metadata['Version']
+
+    def read(self, name):
+        return self._distribution.read_text(name)
+
+    def requires(self):
+        if os.path.isfile(self.metadata_path):
+            return self._metadata.get_all('Requires-Dist') or []
+        # This also converts an .egg-info's requires.txt.
+        return self._distribution.requires or []
+
+
+class _PkgResourcesDistribution(InstalledDistribution):
+    def __init__(self, distribution):
+        super(_PkgResourcesDistribution, self).__init__(
+            distribution._provider.egg_info)
+        self._distribution = distribution
+
+    @property
+    def project_name(self):
+        return self._distribution.project_name
+
+    @property
+    def version(self):
+        return self._distribution.version
+
+    def read(self, name):
+        if not self._distribution.has_metadata(name):
+            return None
+        return self._distribution.get_metadata(name)
+
+    def requires(self):
+        # pkg_resources has already dropped those for extras, and those whose
+        # markers don't match this interpreter.
+        return [str(requirement)
+                for requirement in self._distribution.requires()]
+
+
+class Context(object):
+    """The answers to questions about what's installed, computed once.
+
+    Without this, every strategy asks for the distribution itself, and the
+    import based strategies each walk sys.path again.  Instead, the first
+    question scans every sys.path directory once, for both distribution
+    metadata and top-level modules, and every strategy (and in batch mode,
+    every distribution) shares the answers.
+
+    Where importlib.metadata is available, it is used to read the metadata,
+    and pkg_resources is never imported.  Building its working set of every
+    distribution on sys.path is most of the cost of starting up on hosts
+    with lots of packages installed.
+    """
+
+    def __init__(self, path=None):
+        self._path = sys.path if path is None else path
+        self._distributions = None
+        self._modules = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _make_stamp(self):
+        # Installing or removing anything changes the modification time of
+        # the sys.path directory it's installed in.
+        stamp = []
+        for entry in self._path:
+            try:
+                stamp.append(os.stat(entry or os.curdir).st_mtime)
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+    def is_stale(self):
+        """Has anything been installed or removed since the scan?"""
+        return self._modules is not None and self._make_stamp() != self._stamp
+
+    def _pkg_resources_distributions(self):
+        import pkg_resources
+        distributions = {}
+        # Importing pkg_resources already scanned sys.path, so reuse that
+        # rather than doing it all again.
+        working_set = (
+            pkg_resources.working_set
+            if self._path is sys.path
+            else pkg_resources.WorkingSet(self._path))
+        # The working set is in sys.path order, and like the import system,
+        # the first one found wins.
+        for distribution in working_set:
+            if getattr(distribution._provider, 'egg_info', None) is None:
+                continue
+            distributions.setdefault(
+                normalize(distribution.project_name),
+                _PkgResourcesDistribution(distribution))
+        return distributions
+
+    def load(self):
+        """Do all the scanning now, rather than on the first question."""
+        if self._modules is not None:
+            return
+        # Any number of threads may be asking questions at once, but only
+        # one of them needs to scan.
+        with self._lock:
+            if self._modules is not None:
+                return
+            with get_timings().phase('scan'):
+                self._scan()
+
+    def _scan(self):
+        self._stamp = self._make_stamp()
+        modules = {}
+        distributions = {}
+        for entry in self._path:
+            directory = os.path.abspath(entry or os.curdir)
+            try:
+                # Sort so that stray duplicates are at least resolved
+                # predictably.
+                entries = _list_directory(directory)
+            except OSError:
+                # Nonexistent directories, zip files, and the like.
+                continue
+            # name -> (preference, Module), where lower is better.
+            found = {}
+            for filename, is_dir in entries:
+                path = os.path.join(directory, filename)
+                if filename.endswith(METADATA_SUFFIXES):
+                    # The file name is the escaped project name, optionally
+                    # followed by a dash and the version.
+                    name = filename.rsplit('.', 1)[0].split('-')[0]
+                    if normalize(name) not in distributions:
+                        distributions[normalize(name)] = path
+                    continue
+                if '.' not in filename:
+                    if (is_dir is not False and
+                            os.path.isfile(os.path.join(path, '__init__.py'))):
+                        # Packages take precedence over modules.
+                        found[filename] = (-1, Module(filename, path, True))
+                    continue
+                for preference, suffix in enumerate(SUFFIXES):
+                    name = filename[:-len(suffix)]
+                    if not filename.endswith(suffix) or '.' in name:
+                        continue
+                    if preference < found.get(name, (len(SUFFIXES),))[0]:
+                        found[name] = (preference, Module(name, path, False))
+                    break
+            for name, (preference, module) in found.items():
+                modules.setdefault(name, module)
+        if importlib_metadata is None:
+            self._distributions = self._pkg_resources_distributions()
+        else:
+            self._distributions = dict(
+                (name, _ImportlibDistribution(path))
+                for name, path in distributions.items())
+        self._modules = modules
+
+    def distribution(self, name):
+        """Return the `InstalledDistribution` called `name` or None."""
+        self.load()
+        return self._distributions.get(normalize(name))
+
+    def distributions(self):
+        """Return every `InstalledDistribution`, sorted by name.
+
+        Like `distribution()`, where the same project is installed in more
+        than one place, only the first on the path is included.
+        """
+        self.load()
+        return [self._distributions[name]
+                for name in sorted(self._distributions)]
+
+    def module(self, name):
+        """Return the `Module` importable as `name` or None."""
+        self.load()
+        return self._modules.get(name)
+
+
+_context = None
+_context_lock = threading.Lock()
+
+
+def reset_context():
+    """Forget the process-wide context, so the next one starts afresh.
+
+    Anything still using the old one carries on doing so.
+    """
+    global _context
+    with _context_lock:
+        _context = None
+
+
+def get_context():
+    """Return the process-wide context, creating it if necessary."""
+    global _context
+    with _context_lock:
+        if _context is None:
+            _context = Context()
+        return _context
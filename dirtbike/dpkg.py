@@ -0,0 +1,213 @@
+"""An in-process index of the dpkg database's file ownership information."""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import os
+import sys
+import errno
+import marshal
+import threading
+import tempfile
+
+from glob import glob
+from .cache import cache_dir
+from .timings import get_timings
+
+
+DPKG_INFO_DIR = '/var/lib/dpkg/info'
+# Bump this whenever the layout of the cached index changes.
+CACHE_FORMAT = 1
+
+
+class DpkgLookupError(LookupError):
+    """The path or package is not known to the dpkg database."""
+
+
+class DpkgIndex(object):
+    """Answer `dpkg -S` and `dpkg -L` style queries without forking dpkg.
+
+    `dpkg -S` does a linear scan of every `*.list` file in the dpkg database
+    on every call, so instead we read them all once, the first time they're
+    needed, and keep a path->package and package->files index in memory.
+
+    Even reading them once is slow on a host with lots of packages installed,
+    so if `cache_file` is given, the index is also saved there and reused by
+    later processes until the dpkg database changes.
+    """
+
+    def __init__(self, info_dir=DPKG_INFO_DIR, cache_file=None):
+        self._info_dir = info_dir
+        self._cache_file = cache_file
+        self._owners = None
+        self._files = None
+        self._loaded_key = None
+        self._lock = threading.Lock()
+
+    def _cache_key(self):
+        # dpkg rewrites the status file on every package operation, and it
+        # replaces *.list files by renaming them into place, which touches
+        # the info directory.  That makes the two of them a cheap proxy for
+        # the contents of every *.list file.
+        status_file = os.path.join(os.path.dirname(self._info_dir), 'status')
+        key = [CACHE_FORMAT, self._info_dir]
+        for path in (self._info_dir, status_file):
+            try:
+                info = os.stat(path)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+                key.extend([None, None])
+            else:
+                key.extend([info.st_mtime, info.st_size])
+        return key
+
+    def _read_cache(self, key):
+        try:
+            # marshal.loads() on the whole file is several times faster than
+            # marshal.load() on the open file.
+            with open(self._cache_file, 'rb') as fp:
+                cached_key, owners, files = marshal.loads(fp.read())
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            # A missing, unreadable, or corrupt cache is just a cache miss.
+            return None
+        if cached_key != key:
+            return None
+        return owners, files
+
+    def _write_cache(self, key, owners, files):
+        dirname = os.path.dirname(self._cache_file)
+        try:
+            try:
+                os.makedirs(dirname)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+            # Write to a temporary file and rename it into place, so
+            # concurrent dirtbikes never see a partially written cache.
+            fd, tmpfile = tempfile.mkstemp(dir=dirname)
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    marshal.dump([key, owners, files], fp)
+                os.rename(tmpfile, self._cache_file)
+            except BaseException:
+                os.remove(tmpfile)
+                raise
+        except (IOError, OSError):
+            # Not being able to save the cache shouldn't stop us.
+            pass
+
+    def _read_lists(self):
+        files = {}
+        for list_file in glob(os.path.join(self._info_dir, '*.list')):
+            # Multi-Arch: same packages have an architecture qualifier,
+            # e.g. libfoo:amd64.list, which is part of the package name as
+            # far as dpkg is concerned.
+            package = os.path.basename(list_file)[:-len('.list')]
+            with open(list_file, 'rb') as fp:
+                contents = fp.read()
+            if not isinstance(contents, str):
+                # Decode the paths the same way os.listdir() would, so that
+                # a file name which isn't valid in this locale, in some
+                # unrelated package, can't break the whole index.
+                contents = os.fsdecode(contents)
+            files[package] = contents.splitlines()
+        return files
+
+    def load(self):
+        """Read the dpkg database now, rather than on the first query.
+
+        Once it's been read, this does nothing.  Use `is_stale()` to find
+        out whether it needs reading again, in a new `DpkgIndex`.
+        """
+        # The files are set last, so once they're there, so is everything
+        # else.  Until then, threads wait for whichever got here first.
+        if self._files is not None:
+            return
+        with self._lock:
+            if self._files is not None:
+                return
+            with get_timings().phase('dpkg_index'):
+                self._load()
+
+    def _load(self):
+        cached = None
+        key = self._cache_key()
+        self._loaded_key = key
+        if self._cache_file is not None:
+            cached = self._read_cache(key)
+        if cached is not None:
+            get_timings().count('dpkg_index_cache_hits')
+            self._owners, self._files = cached
+            return
+        files = self._read_lists()
+        owners = {}
+        # Sort so that when a path is owned by more than one package (which
+        # is common for directories), the winner is at least predictable.
+        for package in sorted(files):
+            for path in files[package]:
+                owners.setdefault(path, package)
+        if self._cache_file is not None:
+            # marshal shares the path strings between the two maps, so
+            # saving both costs little more than saving one.
+            self._write_cache(key, owners, files)
+        self._owners = owners
+        self._files = files
+
+    def is_stale(self):
+        """Has the dpkg database changed since it was read?"""
+        return (self._owners is not None
+                and self._cache_key() != self._loaded_key)
+
+    def owner(self, path):
+        """Return the name of the package that owns `path`.
+
+        This is the equivalent of `dpkg -S <path>` for an absolute path.
+        Raises DpkgLookupError if no installed package owns it.
+        """
+        self.load()
+        try:
+            return self._owners[os.path.normpath(path)]
+        except KeyError:
+            raise DpkgLookupError(path)
+
+    def files(self, package):
+        """Return the list of paths installed by `package`.
+
+        This is the equivalent of `dpkg -L <package>`.  Raises DpkgLookupError
+        if `package` is not installed.
+        """
+        self.load()
+        try:
+            return self._files[package]
+        except KeyError:
+            raise DpkgLookupError(package)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def reset_index():
+    """Forget the process-wide dpkg index, so the next one starts afresh.
+
+    Anything still using the old one carries on doing so.
+    """
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def get_index():
+    """Return the process-wide dpkg index, creating it if necessary."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            # The marshal format is specific to the Python version.
+            cache_file = os.path.join(
+                cache_dir(),
+                'dpkg-index.py{}{}'.format(*sys.version_info[:2]))
+            _index = DpkgIndex(cache_file=cache_file)
+        return _index
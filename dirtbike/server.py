@@ -0,0 +1,300 @@
+"""A long-lived dirtbike which rewheels on behalf of clients.
+
+Every dirtbike process has to start an interpreter, scan sys.path, and read
+the dpkg database before it can rewheel anything, which adds up when a build
+farm runs it thousands of times a day.  Instead, `dirtbike serve` does all
+that once, and then rewheels whatever its clients ask for over a Unix
+socket, rescanning only when something has been installed or removed.
+
+The protocol is one JSON object per line.  The client sends a request, the
+daemon sends back a response, and the connection is closed.  See `build()`
+for what's in the request, and the response is either `{"results": [[name,
+wheel, error], ...]}` or `{"error": traceback}`.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import os
+import json
+import errno
+import socket
+import threading
+import traceback
+
+from .batch import (
+    Result, build_many, fresh_pool, preload, site_distributions)
+from .bytecode import compile_pool as make_compile_pool
+from .callout import reset_callout
+from .cache import DEFAULT_MAX_SIZE, WheelCache
+from .context import get_context, reset_context
+from .dpkg import DPKG_INFO_DIR, get_index, reset_index
+from .writer import COMPRESS_THREADS, DEFAULT_COMPRESSION, MAX_IN_FLIGHT_BYTES
+from contextlib import contextmanager
+
+try:
+    import socketserver
+except ImportError:
+    # Python 2.
+    import SocketServer as socketserver
+
+
+class DaemonError(Exception):
+    """The daemon couldn't handle the request."""
+
+
+def _read_message(fp):
+    line = fp.readline()
+    if len(line) == 0:
+        raise DaemonError('Connection closed')
+    return json.loads(line.decode('utf-8'))
+
+
+def _write_message(fp, message):
+    fp.write(json.dumps(message).encode('utf-8') + b'\n')
+    fp.flush()
+
+
+class Daemon(object):
+    """The state the daemon keeps between requests.
+
+    That's the lookup context and dpkg index, which are loaded at startup
+    and reloaded whenever they're stale, and if `jobs` is more than 1, a
+    pool of worker processes, which load their own and are replaced along
+    with them.  The workers aren't forked, since other requests' threads
+    may be holding locks at the time.  Requests are
+    handled concurrently, in their own threads; without a pool, each
+    request's distributions are rewheeled in that thread, and their
+    bytecode compiled in a pool shared by every request, started the first
+    time it's needed.
+    """
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self._lock = threading.Lock()
+        self._pool = None
+        self._compile_pool = None
+        # pool -> the number of requests using it.
+        self._users = {}
+
+    def _retire(self, pool):
+        # Close a pool once nothing is using it.  Don't wait for the workers
+        # to exit, since that's what the pool's own threads are for.
+        if self._users.get(pool, 0) == 0:
+            self._users.pop(pool, None)
+            pool.close()
+
+    def _refresh(self):
+        # Called with the lock held.
+        stale = get_context().is_stale() or (
+            os.path.isdir(DPKG_INFO_DIR) and get_index().is_stale())
+        if stale:
+            # Requests already underway carry on with what they've got.
+            reset_context()
+            reset_index()
+            reset_callout()
+            if self._pool is not None:
+                pool, self._pool = self._pool, None
+                self._retire(pool)
+        preload()
+        if self.jobs > 1 and self._pool is None:
+            self._pool = fresh_pool(self.jobs, preload)
+
+    @contextmanager
+    def _checkout(self):
+        # Bring the lookups up to date, and lend the pool to a request.
+        with self._lock:
+            self._refresh()
+            pool = self._pool
+            if pool is not None:
+                self._users[pool] = self._users.get(pool, 0) + 1
+        try:
+            yield pool
+        finally:
+            if pool is not None:
+                with self._lock:
+                    self._users[pool] -= 1
+                    if pool is not self._pool:
+                        self._retire(pool)
+
+    def handle(self, request):
+        """Handle a request, returning the response."""
+        directory = request.get('directory')
+        if directory is None or not os.path.isabs(directory):
+            raise DaemonError('The directory must be an absolute path')
+        cache = (
+            WheelCache(max_size=request.get('cache_size', DEFAULT_MAX_SIZE))
+            if request.get('cache', True)
+            else None)
+        compile_pool = None
+        if request.get('compile_level') is not None and self.jobs == 1:
+            with self._lock:
+                if self._compile_pool is None:
+                    self._compile_pool = make_compile_pool()
+                compile_pool = self._compile_pool
+        with self._checkout() as pool:
+            names = list(request.get('packages', []))
+            if request.get('all', False):
+                names.extend(site_distributions(request.get('site')))
+            results = build_many(
+                names, directory, cache=cache,
+                with_deps=request.get('with_deps', False),
+                compression=request.get('compression', DEFAULT_COMPRESSION),
+                both_pythons=request.get('both_pythons', False),
+                compile_level=request.get('compile_level'),
+                compress_threads=request.get(
+                    'compress_threads', COMPRESS_THREADS),
+                max_in_flight_bytes=request.get(
+                    'max_in_flight_bytes', MAX_IN_FLIGHT_BYTES),
+                pool=pool, compile_pool=compile_pool)
+        return dict(results=[list(result) for result in results])
+
+    def close(self):
+        """Shut down the worker processes."""
+        with self._lock:
+            pools = set(self._users)
+            if self._pool is not None:
+                pools.add(self._pool)
+            self._pool = None
+            self._users = {}
+            if self._compile_pool is not None:
+                pools.add(self._compile_pool)
+                self._compile_pool = None
+        for pool in pools:
+            pool.terminate()
+            pool.join()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if len(line) == 0:
+            # The client hung up without asking for anything, e.g. another
+            # daemon checking whether this one is alive.
+            return
+        try:
+            response = self.server.daemon.handle(
+                json.loads(line.decode('utf-8')))
+        except Exception:
+            # Don't let one bad request take down the daemon.
+            response = dict(error=traceback.format_exc())
+        _write_message(self.wfile, response)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # The daemon writes wheels wherever its clients ask, so only its own
+        # user may connect.  The socket's mode comes from the umask, and
+        # setting it afterwards would leave a window when it was open to
+        # all.  In Python 2 this is an old-style class, so no super().
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+
+def _remove_stale_socket(socket_path):
+    # A socket left behind by a daemon that died can't be bound again, but
+    # one that's still being served mustn't be stolen.
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error as error:
+        if error.errno == errno.ENOENT:
+            return
+        if error.errno != errno.ECONNREFUSED:
+            raise
+        os.remove(socket_path)
+    else:
+        raise DaemonError('Already serving on {}'.format(socket_path))
+    finally:
+        sock.close()
+
+
+def serve(socket_path, jobs=1):
+    """Serve requests on the Unix socket at `socket_path` until interrupted.
+
+    With `jobs` greater than 1, distributions are rewheeled in a pool of
+    that many worker processes, shared by all requests.
+
+    Only the user running the daemon can connect to the socket, since
+    clients can ask for wheels to be written into any directory.
+    """
+    _remove_stale_socket(socket_path)
+    daemon = Daemon(jobs)
+    # Warm everything up before accepting the first request.
+    with daemon._checkout():
+        pass
+    server = _Server(socket_path, _Handler)
+    server.daemon = daemon
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.remove(socket_path)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+        daemon.close()
+
+
+def request(socket_path, message):
+    """Send `message` to the daemon at `socket_path`, returning its response.
+
+    Raises DaemonError if the daemon reports an error.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        # In Python 2 these aren't context managers.
+        fp = sock.makefile('wb')
+        try:
+            _write_message(fp, message)
+        finally:
+            fp.close()
+        fp = sock.makefile('rb')
+        try:
+            response = _read_message(fp)
+        finally:
+            fp.close()
+    finally:
+        sock.close()
+    if 'error' in response:
+        raise DaemonError(response['error'])
+    return response
+
+
+def build(socket_path, names, directory=None, cache=True,
+          cache_size=DEFAULT_MAX_SIZE, with_deps=False,
+          compression=DEFAULT_COMPRESSION, everything=False, site=None,
+          both_pythons=False, compile_level=None,
+          compress_threads=COMPRESS_THREADS,
+          max_in_flight_bytes=MAX_IN_FLIGHT_BYTES):
+    """Ask the daemon at `socket_path` to rewheel distributions.
+
+    The arguments are the same as for `build_many()`, except that `cache`
+    and `cache_size` say whether and how the daemon uses its `WheelCache`,
+    and `everything` and `site` ask it to rewheel the distributions returned
+    by `site_distributions()` too.  `directory` defaults to the current
+    directory, and it and `site` are relative to the client's current
+    directory rather than the daemon's.
+
+    Returns a list of `Result` objects.
+    """
+    directory = os.path.abspath(os.getcwd() if directory is None
+                                else directory)
+    if site is not None:
+        site = os.path.abspath(site)
+    response = request(socket_path, dict(
+        packages=list(names), directory=directory, cache=cache,
+        cache_size=cache_size, with_deps=with_deps, compression=compression,
+        all=everything, site=site, both_pythons=both_pythons,
+        compile_level=compile_level, compress_threads=compress_threads,
+        max_in_flight_bytes=max_in_flight_bytes))
+    return [Result(*result) for result in response['results']]
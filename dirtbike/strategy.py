@@ -4,60 +4,55 @@ from __future__ import (
 
 
 import os
-import imp
-import sys
-import errno
-import importlib
-import subprocess
-import pkg_resources
-
-
-def _abspathify(filenames, location):
-    paths = []
-    for filename in filenames:
-        # The list of files sometimes contains the empty string. That's not
-        # much of a file, so we don't bother adding it to the archive.
-        if len(filename) == 0:
-            continue
-        # NOTE: If a file is not in the "location" that the installed package
-        # supposedly lives in, we skip it.  This means we are likely to skip
-        # console scripts.
-        if filename.startswith('/'):
-            abspath = os.path.abspath(filename)
-        else:
-            abspath = os.path.abspath(os.path.join(location, filename))
-
-        found = False
-        is_file = False
-        if abspath.startswith(location) and os.path.exists(abspath):
-            found = True
-            is_file = os.path.isfile(abspath)
-        # Print a warning in the case that some file is missing, then skip it.
-        if not found:
-            print('Skipping', abspath,
-                  'because we could not find it in the metadata location.')
-            continue
-        # Skip directories.
-        if found and not is_file:
-            continue
-
-        # Skip the dist-info directory, since bdist_wheel will
-        # recreate it for us.
-        if '.dist-info' in abspath:
-            continue
-
-        # Skip any *.pyc files or files that are in a __pycache__ directory.
-        if '__pycache__' in abspath or abspath.endswith('.pyc'):
-            continue
-        paths.append(abspath)
-    return paths
+
+from .callout import CalloutError, get_callout
+from .collector import collect, warn_skipped
+from .context import get_context
+from .dpkg import DpkgLookupError, get_index
+
+
+def _in_site_packages(path):
+    # Don't allow a stdlib module to sneak in.  Debian's Python 2 backports
+    # of stdlib modules, such as enum34, are imported from the stdlib by
+    # Python 3.
+    path_components = path.split(os.sep)
+    return ('site-packages' in path_components
+            or 'dist-packages' in path_components)
 
 
 class Strategy(object):
-    """Encapsulation of a distribution's contents strategies."""
+    """Encapsulation of a distribution's contents strategies.
 
-    def __init__(self, name):
+    Strategies are tried in order until one of them can succeed, so they
+    must be cheap to create and to ask whether they can succeed.  The
+    expensive part, finding all of the distribution's files, only happens
+    when the `files` of the winning strategy are asked for.
+    """
+
+    def __init__(self, name, context=None, index=None):
         self._name = name
+        self._context = get_context() if context is None else context
+        # Only the dpkg strategies need this, and only once they're sure
+        # they can succeed, so don't create it until then.
+        self._index = index
+        self._can_succeed = None
+        self._files = None
+
+    def _probe(self):
+        """Decide whether this strategy applies, as cheaply as possible.
+
+        Return a boolean.  Subclasses should stash away anything they learn
+        that they'll need later to find the files.
+        """
+        raise NotImplementedError
+
+    def _list_files(self):
+        """Return an iterable of the distribution's files.
+
+        This is only called after `_probe()` has returned True.  Where
+        possible, it should be an iterator which finds the files as it goes.
+        """
+        raise NotImplementedError
 
     @property
     def name(self):
@@ -67,63 +62,90 @@ class Strategy(object):
     @property
     def can_succeed(self):
         """A boolean which describes whether this strategy can succeed."""
-        raise NotImplementedError
+        if self._can_succeed is None:
+            self._can_succeed = self._probe()
+        return self._can_succeed
 
     @property
     def version(self):
         """The version associated with the installed package."""
 
+    @property
+    def requires(self):
+        """The distribution's requirements, as PEP 508 strings.
+
+        This is empty if the strategy didn't find any metadata.
+        """
+        return []
+
     @property
     def files(self):
         """A list of files contained in the package or None.
 
-        If this strategy cannot find the named package's contents, this
-        attribute will be None.
+        These are relative to `location`, or absolute.  If this strategy
+        cannot find the named package's contents, this attribute will be
+        None.
         """
-        raise NotImplementedError
+        if self._files is None and self.can_succeed:
+            self._files = list(self._list_files())
+        return self._files
+
+    def iter_files(self):
+        """Like `files`, but an iterator, which finds the files as it goes.
+
+        Rather than holding the whole list in memory, each call lists them
+        afresh, unless `files` already has.
+        """
+        if self._files is not None:
+            return iter(self._files)
+        if not self.can_succeed:
+            return None
+        return iter(self._list_files())
+
+    def collect(self, skipped=warn_skipped):
+        """Generate an `InstalledFile` for each file in the wheel.
+
+        The files are found, and stat'ed, as the generator is consumed.  See
+        `dirtbike.collector.collect()` for what's left out, and what
+        `skipped` is for.
+        """
+        return collect(self.iter_files(), self.location, skipped)
 
     @property
     def location(self):
         """The metadata location."""
         raise NotImplementedError
 
+    @property
+    def metadata_dir(self):
+        """The name of the distribution's .egg-info or .dist-info, or None.
 
-class WheelStrategy(Strategy):
-    """Use wheel metadata to find package contents."""
+        This is None if the strategy didn't find any metadata.
+        """
+        return None
 
-    def __init__(self, name):
-        super(WheelStrategy, self).__init__(name)
-        self._files = None
-        try:
-            self._metadata = pkg_resources.get_distribution(self._name)
-        except pkg_resources.DistributionNotFound:
-            return
-        try:
-            # If we're lucky, the information for what files are installed on
-            # the system are available in RECORD, aka wheel metadata.
-            files = self._metadata.get_metadata('RECORD').splitlines()
-        # Python 3 - use FileNotFoundError
-        except IOError as error:
-            self._files = None
-            # Let's find the path to an egg-info file and ask dpkg for the
-            # file metadata.
-            if error.errno == errno.ENOENT:
-                return
-            raise
-        self._files = _abspathify(files, self._metadata.location)
 
-    @property
-    def can_succeed(self):
-        return self._files is not None
+class MetadataStrategy(Strategy):
+    """Use the installed metadata's own list of files."""
+
+    def _probe(self):
+        self._metadata = self._context.distribution(self._name)
+        if self._metadata is None:
+            return False
+        # If we're lucky, the information for what files are installed on
+        # the system are available in RECORD, aka wheel metadata, or the
+        # installed-files.txt that pip writes when installing from source.
+        # If not, one of the dpkg strategies will have to find the files.
+        return (self._metadata.has('RECORD')
+                or self._metadata.has('installed-files.txt'))
+
+    def _list_files(self):
+        return self._metadata.iter_files()
 
     @property
     def version(self):
         return self._metadata.version
 
-    @property
-    def files(self):
-        return self._files
-
     @property
     def name(self):
         return self._metadata.project_name
@@ -132,20 +154,36 @@ class WheelStrategy(Strategy):
     def location(self):
         return self._metadata.location
 
+    @property
+    def metadata_dir(self):
+        return os.path.basename(self._metadata.metadata_path)
+
+    @property
+    def requires(self):
+        return self._metadata.requires()
+
+
+# This strategy used to only understand RECORD.
+WheelStrategy = MetadataStrategy
+
 
 class _DpkgBaseStrategy(object):
+    # Use the process-wide index unless the strategy was given one.
+    _index = None
+
+    def _dpkg_index(self):
+        return get_index() if self._index is None else self._index
+
     def _find_files(self, path_to_some_file, relative_to):
-        stdout = subprocess.check_output(
-            ['/usr/bin/dpkg', '-S', path_to_some_file],
-            universal_newlines=True)
-        pkg_name, colon, path = stdout.partition(':')
-        stdout = subprocess.check_output(
-            ['/usr/bin/dpkg', '-L', pkg_name],
-            universal_newlines=True)
+        # This used to shell out to `dpkg -S` and `dpkg -L`, but the former
+        # scans the entire dpkg database on every call, so use our own index
+        # of it instead.
+        index = self._dpkg_index()
+        pkg_name = index.owner(path_to_some_file)
         # Now we have all the files from the Debian package.  However,
         # RECORD-style files lists are all relative to the site-packages
         # directory in which the package was installed.
-        for filename in stdout.splitlines():
+        for filename in index.files(pkg_name):
             if filename.startswith(relative_to):
                 shortened_filename = filename[len(relative_to):]
                 if len(shortened_filename) == 0:
@@ -166,144 +204,169 @@ class DpkgEggStrategy(Strategy, _DpkgBaseStrategy):
     #
     # To be semver-esque, a version with the Debian-specific code
     # removed would presumably have a bumped "major" version number.
-    def __init__(self, name):
-        super(DpkgEggStrategy, self).__init__(name)
-        try:
-            self._metadata = pkg_resources.get_distribution(name)
-        except pkg_resources.DistributionNotFound:
-            self._metadata = None
-            return
+    def _probe(self):
+        self._metadata = self._context.distribution(self._name)
+        return self._metadata is not None
+
+    def _list_files(self):
         # Find the .egg-info directory, and then search the dpkg database for
         # which package provides it.
-        path_to_egg_info = self._metadata._provider.egg_info
-        self._files = list(self._find_files(path_to_egg_info,
-                                            self._metadata.location))
+        path_to_egg_info = self._metadata.metadata_path
+        return self._find_files(path_to_egg_info, self._metadata.location)
 
     @property
     def name(self):
         return self._metadata.project_name
 
-    @property
-    def can_succeed(self):
-        return self._metadata is not None
-
     @property
     def version(self):
         return self._metadata.version
 
-    @property
-    def files(self):
-        return self._files
-
     @property
     def location(self):
         return self._metadata.location
 
+    @property
+    def metadata_dir(self):
+        return os.path.basename(self._metadata.metadata_path)
 
-class DpkgImportlibStrategy(Strategy, _DpkgBaseStrategy):
-    """Use dpkg based on Python 3's importlib."""
+    @property
+    def requires(self):
+        return self._metadata.requires()
 
-    def __init__(self, name):
-        super(DpkgImportlibStrategy, self).__init__(name)
-        spec = self._spec = None
-        try:
-            spec = importlib.util.find_spec(name)
-        except AttributeError:
-            # Must be Python 2.
-            pass
-        if spec is None or not spec.has_location:
-            return
-        # I'm not sure what to do if this is a namespace package, so punt.
-        if (    spec.submodule_search_locations is None
-                or len(spec.submodule_search_locations) != 1):
-            return
-        self._spec = spec
-        location = spec.submodule_search_locations[0]
+
+class DpkgImportlibStrategy(Strategy, _DpkgBaseStrategy):
+    """Use dpkg to find the contents of an importable package."""
+
+    # This used to ask importlib.util.find_spec() directly, but the context
+    # has already found every top-level module on sys.path, and agrees with
+    # find_spec() about the cases we care about.
+    def _probe(self):
+        module = self._context.module(self._name)
+        # I'm not sure what to do if this is a namespace package, or a plain
+        # module, so punt.
+        if module is None or not module.is_package:
+            return False
+        self._origin = os.path.join(module.path, '__init__.py')
         # The location will be the package directory, but we need its parent
         # so that imports will work.  This will very likely be
         # /usr/lib/python3/dist-packages
-        location = self._location = os.path.dirname(location)
-        self._files = list(self._find_files(self._spec.origin, location))
+        self._location = os.path.dirname(module.path)
+        return True
 
-    @property
-    def can_succeed(self):
-        return self._spec is not None
+    def _list_files(self):
+        return self._find_files(self._origin, self._location)
 
     @property
     def location(self):
         return self._location
 
-    @property
-    def files(self):
-        return self._files
-
 
 class DpkgImpStrategy(Strategy, _DpkgBaseStrategy):
-    """Use dpkg based on Python 2's imp API."""
+    """Use dpkg to find the contents of an importable site-packages module."""
 
-    def __init__(self, name):
-        super(DpkgImpStrategy, self).__init__(name)
+    # Like DpkgImportlibStrategy, this gets the same answers as
+    # imp.find_module() from the context.
+    def _probe(self):
         self._location = None
-        try:
-            filename, pathname, description = imp.find_module(name)
-        except ImportError:
-            return
-        if pathname is None:
-            return
-        # Don't allow a stdlib package to sneak in.
-        path_components = pathname.split(os.sep)
-        if (    'site-packages' not in path_components
-                and 'dist-packages' not in path_components):
-            return
+        module = self._context.module(self._name)
+        if module is None:
+            return False
+        pathname = module.path
+        if not _in_site_packages(pathname):
+            return False
+        self._pathname = pathname
         # The location will be the package directory, but we need it's parent
         # so that imports will work.  This will very likely be
         # /usr/lib/python2.7/dist-packages
-        location = self._location = os.path.dirname(pathname)
-        self._files = list(self._find_files(pathname, location))
+        self._location = os.path.dirname(pathname)
+        return True
 
-    @property
-    def can_succeed(self):
-        return self._location is not None
+    def _list_files(self):
+        return self._find_files(self._pathname, self._location)
 
     @property
     def location(self):
         return self._location
 
-    @property
-    def files(self):
-        return self._files
-
 
 class DpkgImportCalloutStrategy(Strategy, _DpkgBaseStrategy):
     """ Use dpkg, but find the file by shelling out to some other Python."""
 
-    def __init__(self, name):
-        super(DpkgImportCalloutStrategy, self).__init__(name)
+    # Even with the helper kept running between distributions, asking the
+    # other interpreter makes this by far the most expensive strategy to
+    # probe, which is one reason it comes last in STRATEGIES.
+    def _probe(self):
         self._location = None
-        other_python = '/usr/bin/python{}'.format(
-            2 if sys.version_info.major == 3 else 3)
         try:
-            stdout = subprocess.check_output(
-                [other_python, '-c',
-                 'import {0}; print({0}.__file__)'.format(name)],
-                universal_newlines=True)
-        except subprocess.CalledProcessError:
-            return
-        filename = stdout.splitlines()[0]
+            answer, = get_callout().find([self._name])
+        except CalloutError:
+            return False
+        if answer.file is None:
+            return False
+        filename = answer.file
         # In Python 2, this will end with .pyc but that's not owned by any
         # package.  So ensure the path ends in .py always.
         root, ext = os.path.splitext(filename)
+        self._filename = root + '.py'
         self._location = os.path.dirname(filename)
-        self._files = list(self._find_files(root + '.py', self._location))
+        return True
 
-    @property
-    def can_succeed(self):
-        return self._location is not None
+    def _list_files(self):
+        return self._find_files(self._filename, self._location)
 
     @property
     def location(self):
         return self._location
 
+
+class OtherPythonStrategy(Strategy, _DpkgBaseStrategy):
+    """Use dpkg to find the other Python's installation of a distribution.
+
+    This is for rewheeling both installations at once, rather than one of
+    the STRATEGIES.  `module` is one of the distribution's top-level modules,
+    which the other interpreter imports to find out where it's installed.
+    Debian builds both installations from the same source, so `version` is
+    the one found for this interpreter.
+    """
+
+    def __init__(self, name, module, version=None, context=None, index=None,
+                 callout=None):
+        super(OtherPythonStrategy, self).__init__(name, context, index)
+        self._module = module
+        self._version = version
+        self._callout = callout
+
+    def _probe(self):
+        self._location = None
+        callout = get_callout() if self._callout is None else self._callout
+        try:
+            answer, = callout.find([self._module])
+        except CalloutError:
+            return False
+        if answer.file is None or not _in_site_packages(answer.file):
+            return False
+        # As for DpkgImportCalloutStrategy, it's the source that dpkg owns,
+        # but unlike there, the location is where the package is, not the
+        # package itself.
+        root, ext = os.path.splitext(answer.file)
+        self._filename = root + '.py'
+        self._location = os.path.dirname(answer.file)
+        if os.path.basename(root) == '__init__':
+            self._location = os.path.dirname(self._location)
+        try:
+            self._dpkg_index().owner(self._filename)
+        except DpkgLookupError:
+            return False
+        return True
+
+    def _list_files(self):
+        return self._find_files(self._filename, self._location)
+
     @property
-    def files(self):
-        return self._files
+    def version(self):
+        return self._version
+
+    @property
+    def location(self):
+        return self._location
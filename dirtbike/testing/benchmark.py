@@ -0,0 +1,280 @@
+"""Benchmark dirtbike against a synthetic site-packages and dpkg database.
+
+Generate fake installed distributions, with a matching fake dpkg database,
+then time each phase of rewheeling them and print the results as JSON, so
+that they can be compared between commits:
+
+    $ python -m dirtbike.testing.benchmark --packages 20 --files 500 \\
+          -o before.json
+
+Run with --help for the knobs.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import platform
+
+from .. import STRATEGIES, _make_wheel
+from .. import context as context_module, dpkg as dpkg_module
+from ..context import Context
+from ..dpkg import DpkgIndex
+from ..timings import clock
+from ..writer import CHUNK_SIZE, WheelWriter
+from .helpers import temporary_directory
+
+
+SITE_PACKAGES = os.path.join('usr', 'lib', 'python3', 'dist-packages')
+INFO_DIR = os.path.join('var', 'lib', 'dpkg', 'info')
+# Split big packages into subpackages of this many modules.
+MODULES_PER_PACKAGE = 100
+
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+
+def _module_source(size):
+    line = b'value = "dirtbike benchmark"\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def make_site(root, packages=10, files=100, size=4096, metadata='egg-info',
+              dpkg_noise=0):
+    """Create fake installed distributions and dpkg database under `root`.
+
+    There are `packages` distributions, each a package of `files` modules of
+    `size` bytes, with `.dist-info` metadata if `metadata` is 'record', or
+    Debian style `.egg-info` metadata if it's 'egg-info'.  Each is owned by
+    its own Debian package in the fake dpkg database, which also has
+    `dpkg_noise` unrelated packages of 100 files each.
+
+    Returns the paths to the site-packages directory and the dpkg info
+    directory, and the list of distribution names.
+    """
+    site = os.path.join(root, SITE_PACKAGES)
+    info_dir = os.path.join(root, INFO_DIR)
+    os.makedirs(site)
+    os.makedirs(info_dir)
+    _write(os.path.join(os.path.dirname(info_dir), 'status'), b'')
+    source = _module_source(size)
+    parents = [root]
+    for component in SITE_PACKAGES.split(os.sep):
+        parents.append(os.path.join(parents[-1], component))
+    names = []
+    for number in range(packages):
+        name = 'bench{:04d}'.format(number)
+        names.append(name)
+        paths = []
+        for module in range(files):
+            subpackage = 'sub{}'.format(module // MODULES_PER_PACKAGE)
+            if module % MODULES_PER_PACKAGE == 0:
+                paths.append(os.path.join(name, subpackage, '__init__.py'))
+            paths.append(os.path.join(
+                name, subpackage, 'mod{}.py'.format(module)))
+        paths.append(os.path.join(name, '__init__.py'))
+        for path in paths:
+            _write(os.path.join(site, path), source)
+        pkg_info = 'Metadata-Version: 1.1\nName: {}\nVersion: 1.0\n'.format(
+            name).encode('utf-8')
+        if metadata == 'record':
+            dist_info = '{}-1.0.dist-info'.format(name)
+            paths.append(os.path.join(dist_info, 'METADATA'))
+            _write(os.path.join(site, paths[-1]), pkg_info)
+            paths.append(os.path.join(dist_info, 'RECORD'))
+            _write(os.path.join(site, paths[-1]), ''.join(
+                '{},,\n'.format(path.replace(os.sep, '/'))
+                for path in paths).encode('utf-8'))
+        else:
+            egg_info = '{}-1.0.egg-info'.format(name)
+            paths.append(os.path.join(egg_info, 'PKG-INFO'))
+            _write(os.path.join(site, paths[-1]), pkg_info)
+            paths.append(os.path.join(egg_info, 'top_level.txt'))
+            _write(os.path.join(site, paths[-1]),
+                   '{}\n'.format(name).encode('utf-8'))
+        # Like the real thing, the .list file includes every directory too.
+        directories = set(parents)
+        for path in paths:
+            path = os.path.dirname(path)
+            while len(path) > 0:
+                directories.add(os.path.join(site, path))
+                path = os.path.dirname(path)
+        listing = sorted(directories) + [
+            os.path.join(site, path) for path in paths]
+        _write(os.path.join(info_dir, 'python3-{}.list'.format(name)),
+               ''.join(line + '\n' for line in listing).encode('utf-8'))
+    for number in range(dpkg_noise):
+        package = 'noise{:05d}'.format(number)
+        listing = ['/usr/share/doc/{}/file{}'.format(package, line)
+                   for line in range(100)]
+        _write(os.path.join(info_dir, '{}.list'.format(package)),
+               ''.join(line + '\n' for line in listing).encode('utf-8'))
+    return site, info_dir, names
+
+
+class _Timer(object):
+    def __init__(self):
+        self.phases = {}
+
+    def time(self, phase, function, *args):
+        start = clock()
+        result = function(*args)
+        self.phases.setdefault(phase, []).append(clock() - start)
+        return result
+
+
+def _resolve(names, context):
+    strategies = []
+    for name in names:
+        for strategy_class in STRATEGIES:
+            strategy = strategy_class(name, context)
+            if strategy.can_succeed:
+                strategies.append(strategy)
+                break
+        else:
+            raise RuntimeError('No strategy for {}'.format(name))
+    return strategies
+
+
+def _collect(strategies):
+    return [(strategy, list(strategy.collect())) for strategy in strategies]
+
+
+def _hash(collected):
+    size = 0
+    for strategy, installed in collected:
+        for info in installed:
+            digest = hashlib.sha256()
+            with open(info.path, 'rb') as fp:
+                while True:
+                    chunk = fp.read(CHUNK_SIZE)
+                    if len(chunk) == 0:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+    return size
+
+
+def _write_wheels(collected, directory):
+    for strategy, installed in collected:
+        writer = WheelWriter(strategy.name, strategy.version,
+                             strategy.location)
+        writer.add_files(installed)
+        writer.write(directory)
+
+
+def _build(names, directory):
+    for name in names:
+        _make_wheel(name, directory)
+
+
+def run(packages=10, files=100, size=4096, metadata='egg-info',
+        dpkg_noise=0, repeat=3):
+    """Generate a synthetic site and time rewheeling it.
+
+    The arguments describing the site are as for `make_site()`.  Each phase
+    is run `repeat` times.  Returns a JSON serializable dictionary of the
+    parameters, counters, and the time in seconds of every run of every
+    phase, along with the best.
+    """
+    timer = _Timer()
+    counters = {}
+    with temporary_directory() as root:
+        site, info_dir, names = make_site(
+            os.path.join(root, 'root'), packages, files, size, metadata,
+            dpkg_noise)
+        wheelhouse = os.path.join(root, 'wheelhouse')
+        os.mkdir(wheelhouse)
+        # The strategies use the process-wide lookups, so point those at the
+        # synthetic ones for the duration.
+        saved = context_module._context, dpkg_module._index
+        try:
+            for run_number in range(repeat):
+                index = DpkgIndex(info_dir)
+                timer.time('dpkg_index', index.load)
+                context = Context([site])
+                timer.time('context', context.load)
+                context_module._context = context
+                dpkg_module._index = index
+                strategies = timer.time('resolve', _resolve, names, context)
+                collected = timer.time('files', _collect, strategies)
+                counters['bytes'] = timer.time('hash', _hash, collected)
+                counters['files'] = sum(
+                    len(installed) for strategy, installed in collected)
+                counters['strategies'] = sorted(set(
+                    type(strategy).__name__ for strategy in strategies))
+                timer.time('write', _write_wheels, collected, wheelhouse)
+                # And the whole thing, end to end, with the lookups warm.
+                timer.time('build', _build, names, wheelhouse)
+            counters['wheel_bytes'] = sum(
+                os.path.getsize(os.path.join(wheelhouse, filename))
+                for filename in os.listdir(wheelhouse))
+        finally:
+            context_module._context, dpkg_module._index = saved
+    return dict(
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        parameters=dict(
+            packages=packages, files=files, size=size, metadata=metadata,
+            dpkg_noise=dpkg_noise, repeat=repeat),
+        counters=counters,
+        phases=dict(
+            (phase, dict(best=min(runs), runs=runs))
+            for phase, runs in timer.phases.items()),
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        'Benchmark dirtbike against a synthetic site-packages')
+    parser.add_argument('--packages', type=int, default=10, metavar='M',
+                        help="""Generate M distributions.  The default is
+                        %(default)s.""")
+    parser.add_argument('--files', type=int, default=100, metavar='N',
+                        help="""Give each distribution N modules.  The
+                        default is %(default)s.""")
+    parser.add_argument('--size', type=int, default=4096, metavar='BYTES',
+                        help="""Make each module BYTES long.  The default is
+                        %(default)s.""")
+    parser.add_argument('--metadata', choices=('record', 'egg-info'),
+                        default='egg-info',
+                        help="""Give the distributions .dist-info metadata
+                        with a RECORD, or Debian style .egg-info metadata,
+                        whose files must be found in the dpkg database.  The
+                        default is %(default)s.""")
+    parser.add_argument('--dpkg-noise', type=int, default=0, metavar='K',
+                        help="""Add K unrelated packages to the dpkg
+                        database.""")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="""Time each phase this many times.  The default
+                        is %(default)s.""")
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help="""Write the JSON results to FILE rather than
+                        standard output.""")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    results = run(args.packages, args.files, args.size, args.metadata,
+                  args.dpkg_noise, args.repeat)
+    text = json.dumps(results, indent=2, sort_keys=True) + '\n'
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w') as fp:
+            fp.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
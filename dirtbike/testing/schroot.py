@@ -1,9 +1,24 @@
+from __future__ import print_function
+
 import os
+import sys
+import shutil
+import atexit
+import tempfile
+
+from dirtbike.testing.helpers import call, chdir, output
+from glob import glob
+from pkg_resources import resource_filename
 
-from dirtbike.testing.helpers import call, output
 
+KEEP_SESSIONS = os.getenv('DIRTBIKE_DEBUG_SESSIONS')
+# Where dirtbike caches things in the session, where it runs as root, and
+# without $HOME, $XDG_CACHE_HOME, or $DIRTBIKE_CACHE_DIR unless a test sets
+# them.
+SESSION_CACHE_DIR = '/root/.cache/dirtbike'
 
-class Session:
+
+class Session(object):
     def __init__(self):
         self.id = None
 
@@ -48,3 +63,158 @@ class Session:
         self.call('rm -rf dist')
         call(['schroot', '-u', 'root', '-c', self.id, '--end-session'])
         self.id = None
+
+
+class PreparedSession(Session):
+    """A session with dirtbike and the example project already installed.
+
+    Beginning a session, installing dirtbike into it, and building and
+    installing the example .deb is most of the cost of an integration test,
+    so do it once, and between tests, `reset()` the session back to the
+    state it was in just after that.
+    """
+
+    def __init__(self):
+        super(PreparedSession, self).__init__()
+        self.python = 'python{}.{}'.format(*sys.version_info[:2])
+        # package name -> path to the .deb we built for it.
+        self._debs = {}
+        self._snapshot = None
+        self._tempdir = None
+
+    def _packages(self):
+        # The set of packages currently installed in the session.
+        result = self.output(
+            ['dpkg-query', '-W', '-f', '${Package}\t${Status}\n'])
+        packages = set()
+        for line in result.splitlines():
+            package, tab, status = line.partition('\t')
+            if status.endswith(' installed'):
+                packages.add(package)
+        return packages
+
+    def _build_example(self):
+        # Build the example .deb on the host, and keep it somewhere that
+        # outlives the build directory, for reinstalling it in `reset()`.
+        base_dir = os.path.abspath(os.path.dirname(
+            resource_filename('dirtbike.tests', '__init__.py')))
+        example_dir = os.path.join(base_dir, 'example', 'stupid')
+        dist_dir = os.path.join(example_dir, 'deb_dist')
+        with chdir(example_dir):
+            try:
+                call([
+                    self.python,
+                    'setup.py', '--no-user-cfg',
+                    '--command-packages=stdeb.command',
+                    'bdist_deb'
+                    ])
+                debs = glob(os.path.join(dist_dir, '*.deb'))
+                assert len(debs) == 1, debs
+                deb = os.path.join(self._tempdir, os.path.basename(debs[0]))
+                shutil.copy(debs[0], deb)
+            finally:
+                # bdist_deb can't be told where to leave its artifacts, so
+                # clean up after it.
+                shutil.rmtree(dist_dir, ignore_errors=True)
+                for tar_gz in glob(os.path.join(example_dir, '*.tar.gz')):
+                    os.remove(tar_gz)
+        package = output(['dpkg-deb', '-f', deb, 'Package']).strip()
+        self._debs[package] = deb
+        return deb
+
+    def prepare(self):
+        """Begin the session, install everything, and take a snapshot."""
+        # The session has to be able to see the .deb, and like the current
+        # directory, /tmp is shared with the host.
+        self._tempdir = tempfile.mkdtemp()
+        try:
+            self.start()
+            self.call([self.python, 'setup.py', 'install'],
+                      env=dict(LC_ALL='en_US.UTF-8'))
+            self.call(['gdebi', '-n', self._build_example()])
+            self._snapshot = self._packages()
+        except BaseException:
+            if self.id is None:
+                shutil.rmtree(self._tempdir, ignore_errors=True)
+            else:
+                self.end()
+            raise
+
+    def reset(self):
+        """Put the installed packages back the way `prepare()` left them.
+
+        Packages installed since are purged, and those removed since are
+        reinstalled, from the .debs we built if they're ours, and from the
+        archive if not.  Wheels left in the current directory are removed,
+        and so is dirtbike's cache, since reinstalled packages' files keep
+        their modification times, and would be rewheeled from it.
+        """
+        assert self._snapshot is not None, 'Session not prepared'
+        packages = self._packages()
+        extra = sorted(packages - self._snapshot)
+        if len(extra) > 0:
+            self.call(['apt-get', 'purge', '-y'] + extra)
+        missing = self._snapshot - packages
+        from_archive = sorted(missing - set(self._debs))
+        if len(from_archive) > 0:
+            self.call(['apt-get', 'install', '-y'] + from_archive)
+        for package in sorted(missing & set(self._debs)):
+            self.call(['dpkg', '-i', self._debs[package]])
+        self.call(['find', '.', '-maxdepth', '1', '-name', '*.whl',
+                   '-delete'])
+        self.call(['rm', '-rf', SESSION_CACHE_DIR])
+
+    def end(self):
+        super(PreparedSession, self).end()
+        self._snapshot = None
+        shutil.rmtree(self._tempdir, ignore_errors=True)
+
+
+_session = None
+
+
+def prepared_session():
+    """Return this process's `PreparedSession`, preparing it if necessary.
+
+    Each process gets its own session, so test processes can run in
+    parallel, e.g. with nose2's mp plugin, without interfering with each
+    other.  The session is ended when the process exits, unless
+    $DIRTBIKE_DEBUG_SESSIONS is set, in which case its id is printed and
+    it's left for you to end.
+    """
+    global _session
+    if _session is None:
+        session = PreparedSession()
+        session.prepare()
+        if KEEP_SESSIONS:
+            print('\n\nKEEPING SESSION:', session.id, file=sys.stderr)
+        else:
+            atexit.register(end_prepared_session)
+        _session = session
+    return _session
+
+
+def end_prepared_session():
+    """End this process's `PreparedSession`, if it has one."""
+    global _session
+    if _session is not None and _session.id is not None:
+        _session.end()
+    _session = None
+
+
+class SessionLayer(object):
+    """A nose2 layer which shares one prepared session between tests.
+
+    The session is prepared before the first test in the layer runs, and
+    ended after the last.  Tests reset it themselves, so that they still
+    work, just more slowly, under runners which don't know about layers.
+    """
+
+    @classmethod
+    def setUp(cls):
+        prepared_session()
+
+    @classmethod
+    def tearDown(cls):
+        if not KEEP_SESSIONS:
+            end_prepared_session()
@@ -0,0 +1,132 @@
+import os
+import unittest
+import multiprocessing
+
+from dirtbike import batch
+from dirtbike.batch import Result, build_many, site_distributions
+from dirtbike.context import Context
+from dirtbike.testing.helpers import temporary_directory
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class FakeStrategy(object):
+    def __init__(self, requires):
+        self.requires = requires
+
+
+# stupid and smart both require six, and smart requires stupid.  Nothing
+# requires anything for its extras.
+REQUIRES = {
+    'stupid': ['six', 'nose2; extra == "test"'],
+    'smart': ['Stupid>=2.0', 'six ; python_version >= "2"'],
+    'six': [],
+    }
+
+
+def _find_strategy(name):
+    return FakeStrategy(REQUIRES[name.lower()])
+
+
+def _build_one(work):
+    name, directory, cache, options = work
+    return Result(name, name + '.whl', None)
+
+
+@mock.patch('dirtbike.batch._build_one', _build_one)
+@mock.patch('dirtbike.batch._find_strategy', _find_strategy)
+class TestBuildMany(unittest.TestCase):
+    def test_without_deps(self):
+        results = build_many(['smart', 'stupid', 'smart'])
+        self.assertEqual([result.name for result in results],
+                         ['smart', 'stupid'])
+
+    def test_with_deps(self):
+        results = build_many(['smart'], with_deps=True)
+        # Shared dependencies are only built once.
+        self.assertEqual([result.name for result in results],
+                         ['smart', 'Stupid', 'six'])
+
+    def test_jobs(self):
+        # The workers are forked after the lookups are loaded.
+        with mock.patch('dirtbike.batch.preload') as preload, \
+                mock.patch('dirtbike.batch.fork_pool',
+                           wraps=batch.fork_pool) as fork_pool:
+            results = build_many(['smart', 'stupid', 'six'], jobs=2)
+        self.assertEqual(results, [
+            Result('smart', 'smart.whl', None),
+            Result('stupid', 'stupid.whl', None),
+            Result('six', 'six.whl', None),
+            ])
+        preload.assert_called_once_with()
+        fork_pool.assert_called_once_with(2)
+
+    @unittest.skipUnless(hasattr(multiprocessing, 'get_context'),
+                         'Python 2 always forks')
+    def test_fork_pool(self):
+        # The lookups are shared however the platform usually starts
+        # workers.
+        with mock.patch('multiprocessing.get_context',
+                        wraps=multiprocessing.get_context) as get_context:
+            pool = batch.fork_pool(1)
+        pool.terminate()
+        pool.join()
+        get_context.assert_called_once_with('fork')
+
+    def test_compile_pool(self):
+        # All the wheels' bytecode is compiled in one pool.
+        pools = []
+
+        def build_one(work):
+            pools.append(work[3]['compile_pool'])
+            return _build_one(work)
+        with mock.patch('dirtbike.batch._build_one', build_one), \
+                mock.patch('dirtbike.batch.make_compile_pool') as make:
+            build_many(['smart', 'stupid'], compile_level=0)
+        self.assertEqual(make.call_count, 1)
+        self.assertEqual(pools, [make.return_value] * 2)
+        make.return_value.terminate.assert_called_once_with()
+
+    def test_extras(self):
+        self.assertEqual(list(batch._dependencies('stupid')),
+                         [('six', True)])
+
+
+class TestSiteDistributions(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.first = os.path.join(tempdir.name, 'first')
+        self.second = os.path.join(tempdir.name, 'second')
+        for filename in ('first/stupid-2.0.egg-info',
+                         'first/smart_thing-1.0.egg-info',
+                         'second/six-1.0.egg-info'):
+            path = os.path.join(tempdir.name, filename)
+            os.makedirs(path)
+            with open(os.path.join(path, 'PKG-INFO'), 'w') as fp:
+                name, version = os.path.basename(path)[:-9].split('-')
+                fp.write('Metadata-Version: 1.1\nName: {}\nVersion: {}\n'
+                         .format(name.replace('_', '-'), version))
+        path = [self.first, self.second]
+        for patcher in (
+                mock.patch('dirtbike.batch.get_context',
+                           return_value=Context(path)),
+                mock.patch('sys.path', path),
+                ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_all(self):
+        self.assertEqual(site_distributions(),
+                         ['six', 'smart-thing', 'stupid'])
+
+    def test_site(self):
+        self.assertEqual(site_distributions(self.first),
+                         ['smart-thing', 'stupid'])
+
+    def test_site_not_on_path(self):
+        self.assertRaises(ValueError, site_distributions,
+                          os.path.dirname(self.first))
@@ -0,0 +1,32 @@
+import os
+import unittest
+
+from dirtbike.context import Context
+from dirtbike.testing.benchmark import make_site, run
+from dirtbike.testing.helpers import temporary_directory
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_make_site(self):
+        with temporary_directory() as root:
+            site, info_dir, names = make_site(
+                root, packages=2, files=3, metadata='record')
+            self.assertEqual(names, ['bench0000', 'bench0001'])
+            self.assertEqual(
+                sorted(os.listdir(info_dir)),
+                ['python3-bench0000.list', 'python3-bench0001.list'])
+            distribution = Context([site]).distribution('bench0001')
+            self.assertEqual(len(distribution.files()), 7)
+
+    def test_run(self):
+        results = run(packages=2, files=3, repeat=2)
+        self.assertEqual(
+            sorted(results['phases']),
+            ['build', 'context', 'dpkg_index', 'files', 'hash', 'resolve',
+             'write'])
+        for phase in results['phases'].values():
+            self.assertEqual(len(phase['runs']), 2)
+            self.assertEqual(phase['best'], min(phase['runs']))
+        self.assertEqual(results['counters']['files'], 14)
+        self.assertEqual(results['counters']['strategies'],
+                         ['DpkgEggStrategy'])
@@ -0,0 +1,236 @@
+import os
+import sys
+import shutil
+import unittest
+import threading
+
+from dirtbike import STRATEGIES, _top_level_module, build_wheel, build_wheels
+from dirtbike.cache import WheelCache
+from dirtbike.callout import Answer, CalloutError
+from dirtbike.collector import installed_file
+from dirtbike.context import Context
+from dirtbike.dpkg import DpkgIndex
+from dirtbike.testing.benchmark import make_site
+from dirtbike.testing.helpers import temporary_directory
+from multiprocessing.pool import ThreadPool
+from zipfile import ZipFile
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def _no_globals():
+    raise AssertionError('The process-wide lookups were used')
+
+
+@mock.patch('dirtbike.strategy.get_context', _no_globals)
+@mock.patch('dirtbike.strategy.get_index', _no_globals)
+class TestBuildWheel(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.root = tempdir.name
+        site, info_dir, self.names = make_site(
+            os.path.join(self.root, 'root'), packages=4, files=3)
+        # dpkg thinks this is installed, but it isn't.
+        self.missing = os.path.join(site, 'bench0000', 'missing.py')
+        with open(os.path.join(info_dir, 'python3-bench0000.list'),
+                  'a') as fp:
+            fp.write(self.missing + '\n')
+        self.context = Context([site])
+        self.index = DpkgIndex(info_dir)
+
+    def _build(self, name, directory, **kws):
+        return build_wheel(name, directory, context=self.context,
+                           index=self.index, **kws)
+
+    def test_build_wheel(self):
+        skipped = []
+        directory = os.path.join(self.root, 'wheelhouse')
+        wheel = self._build('bench0000', directory, skipped=skipped.append)
+        self.assertEqual(
+            wheel,
+            os.path.join(directory, 'bench0000-1.0-py2.py3-none-any.whl'))
+        with ZipFile(wheel) as zf:
+            self.assertIn('bench0000/sub0/mod2.py', zf.namelist())
+        self.assertEqual(skipped, [self.missing])
+
+    def test_strategies(self):
+        # Without the dpkg strategies, there's no way to find the files.
+        with self.assertRaises(RuntimeError):
+            self._build('bench0000', self.root, strategies=STRATEGIES[:1])
+
+    def test_cache_bytecode_tag(self):
+        # Wheels with bytecode are only reused by the same interpreter.
+        cache = WheelCache(os.path.join(self.root, 'cache'))
+        directory = os.path.join(self.root, 'wheelhouse')
+        with mock.patch.object(cache, 'put', wraps=cache.put) as put:
+            for tag in ('cpython-311', 'cpython-311', 'cpython-312'):
+                with mock.patch('dirtbike.bytecode_tag', return_value=tag):
+                    self._build('bench0000', directory, cache=cache,
+                                compile_level=0)
+        self.assertEqual(put.call_count, 2)
+
+    def test_threads(self):
+        # Build everything at once, hashing in one shared pool.
+        pool = ThreadPool(2)
+        self.addCleanup(pool.join)
+        self.addCleanup(pool.close)
+        wheels = {}
+        errors = []
+
+        def build(name):
+            try:
+                wheels[name] = self._build(
+                    name, os.path.join(self.root, name), pool=pool)
+            except Exception as error:
+                errors.append(error)
+        threads = [threading.Thread(target=build, args=(name,))
+                   for name in self.names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(wheels), self.names)
+        for name, wheel in wheels.items():
+            self.assertEqual(os.path.dirname(wheel),
+                             os.path.join(self.root, name))
+            with ZipFile(wheel) as zf:
+                self.assertIsNone(zf.testzip())
+
+
+class TestTopLevelModule(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.site = tempdir.name
+        self.strategy = mock.Mock(location=self.site,
+                                  metadata_dir='smart-1.0.egg-info')
+
+    def _installed(self, files):
+        installed = []
+        for filename, contents in sorted(files.items()):
+            path = os.path.join(self.site, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(contents)
+            installed.append(installed_file(path))
+        return installed
+
+    def test_top_level_txt(self):
+        installed = self._installed({
+            'smart-1.0.egg-info/top_level.txt': 'stupid\nsmart\n',
+            'smart/__init__.py': '',
+            'stupid.py': '',
+            })
+        self.assertEqual(_top_level_module(self.strategy, installed),
+                         'stupid')
+
+    def test_tests(self):
+        # Plenty of distributions install a tests package.
+        installed = self._installed({
+            'smart/__init__.py': '',
+            'tests/__init__.py': '',
+            })
+        installed.reverse()
+        self.assertEqual(_top_level_module(self.strategy, installed),
+                         'smart')
+
+    def test_only_tests(self):
+        installed = self._installed({'tests/__init__.py': ''})
+        self.assertEqual(_top_level_module(self.strategy, installed),
+                         'tests')
+
+
+class _Callout(object):
+    # Pretend the other interpreter found the module in `site`.
+    def __init__(self, site):
+        self.site = site
+
+    def find(self, names):
+        return [Answer(os.path.join(self.site, name, '__init__.pyc'), None)
+                for name in names]
+
+
+class TestBuildWheels(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.root = tempdir.name
+        site, info_dir, names = make_site(
+            os.path.join(self.root, 'root'), packages=1, files=3)
+        # Give the other Python a copy of the same installation, owned by its
+        # own Debian package.
+        self.other_site = os.path.join(
+            self.root, 'root', 'usr', 'lib', 'python2.7', 'dist-packages')
+        shutil.copytree(site, self.other_site)
+        with open(os.path.join(info_dir, 'python-bench0000.list'), 'w') as fp:
+            for directory, dirnames, filenames in os.walk(self.other_site):
+                fp.write(directory + '\n')
+                for filename in filenames:
+                    fp.write(os.path.join(directory, filename) + '\n')
+        self.context = Context([site])
+        self.info_dir = info_dir
+        self.index = DpkgIndex(info_dir)
+        self.directory = os.path.join(self.root, 'wheelhouse')
+
+    def _build(self, callout=None):
+        return build_wheels(
+            'bench0000', self.directory, context=self.context,
+            index=self.index,
+            callout=_Callout(self.other_site) if callout is None else callout)
+
+    def test_same(self):
+        wheels = self._build()
+        self.assertEqual([os.path.basename(wheel) for wheel in wheels],
+                         ['bench0000-1.0-py2.py3-none-any.whl'])
+
+    def test_different(self):
+        path = os.path.join(self.other_site, 'bench0000', 'sub0', 'mod1.py')
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        with open(path, 'wb') as fp:
+            fp.write(b'# Python 2\n' + data[11:])
+        wheels = self._build()
+        self.assertEqual([os.path.basename(wheel) for wheel in wheels], [
+            'bench0000-1.0-py2-none-any.whl',
+            'bench0000-1.0-py3-none-any.whl',
+            ])
+        # The other Python's is the one with the different file.
+        other = 1 if sys.version_info.major == 2 else 0
+        with ZipFile(wheels[other]) as zf:
+            self.assertTrue(zf.read('bench0000/sub0/mod1.py').startswith(
+                b'# Python 2\n'))
+            self.assertIn(
+                'Tag: py{}-none-any\n'.format(2 + other).encode('ascii'),
+                zf.read('bench0000-1.0.dist-info/WHEEL'))
+
+    def test_other_python_stdlib(self):
+        # The other Python's stdlib doesn't count, e.g. for a backport that
+        # Python 3 has had all along.
+        stdlib = os.path.join(self.root, 'root', 'usr', 'lib', 'python3.9')
+        shutil.copytree(self.other_site, stdlib)
+        with open(os.path.join(self.info_dir, 'libpython3.9-stdlib.list'),
+                  'w') as fp:
+            for directory, dirnames, filenames in os.walk(stdlib):
+                fp.write(directory + '\n')
+                for filename in filenames:
+                    fp.write(os.path.join(directory, filename) + '\n')
+        path = os.path.join(stdlib, 'bench0000', 'sub0', 'mod1.py')
+        with open(path, 'ab') as fp:
+            fp.write(b'# Different\n')
+        wheels = self._build(_Callout(stdlib))
+        self.assertEqual([os.path.basename(wheel) for wheel in wheels],
+                         ['bench0000-1.0-py2.py3-none-any.whl'])
+
+    def test_no_other_python(self):
+        callout = mock.Mock()
+        callout.find.side_effect = CalloutError
+        wheels = self._build(callout)
+        self.assertEqual([os.path.basename(wheel) for wheel in wheels],
+                         ['bench0000-1.0-py2.py3-none-any.whl'])
+        callout.find.assert_called_once_with(['bench0000'])
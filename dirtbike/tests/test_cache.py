@@ -0,0 +1,138 @@
+import os
+import time
+import errno
+import unittest
+
+from dirtbike import cache
+from dirtbike.cache import WheelCache, _link_or_copy
+from dirtbike.collector import installed_file
+from dirtbike.testing.helpers import temporary_directory
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class FakeStrategy(object):
+    name = 'stupid'
+    version = '2.0'
+    location = '/usr/lib/python3/dist-packages'
+
+
+class TestWheelCache(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.tempdir = tempdir.name
+        self.cache = WheelCache(os.path.join(self.tempdir, 'cache'))
+        self.source = os.path.join(self.tempdir, 'stupid.py')
+        with open(self.source, 'w') as fp:
+            fp.write('yes = True\n')
+        self.destination = os.path.join(self.tempdir, 'dist')
+        os.mkdir(self.destination)
+
+    def _wheel(self, filename='stupid-2.0-py2.py3-none-any.whl', size=10):
+        path = os.path.join(self.tempdir, filename)
+        with open(path, 'wb') as fp:
+            fp.write(b'x' * size)
+        return path
+
+    def _key(self, options=()):
+        return self.cache.key(
+            FakeStrategy(), [installed_file(self.source)], options)
+
+    def test_key_changes_with_files(self):
+        key = self._key()
+        self.assertEqual(key, self._key())
+        with open(self.source, 'a') as fp:
+            fp.write('no = False\n')
+        self.assertNotEqual(key, self._key())
+
+    def test_key_changes_with_options(self):
+        self.assertNotEqual(self._key(['stored']), self._key(['max']))
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get(
+            'nope', 'stupid-2.0-py2.py3-none-any.whl', self.destination))
+        self.assertEqual(os.listdir(self.destination), [])
+
+    def test_hit(self):
+        self.cache.put('key', self._wheel())
+        wheel = self.cache.get(
+            'key', 'stupid-2.0-py2.py3-none-any.whl', self.destination)
+        self.assertEqual(
+            wheel, os.path.join(self.destination,
+                                'stupid-2.0-py2.py3-none-any.whl'))
+        with open(wheel, 'rb') as fp:
+            self.assertEqual(fp.read(), b'x' * 10)
+        # Getting it again, over the top of the first one, leaves nothing
+        # else behind.
+        self.cache.get(
+            'key', 'stupid-2.0-py2.py3-none-any.whl', self.destination)
+        self.assertEqual(os.listdir(self.destination),
+                         ['stupid-2.0-py2.py3-none-any.whl'])
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_size = 25
+        self.cache.put('first', self._wheel('first.whl'))
+        self.cache.put('second', self._wheel('second.whl'))
+        # Make sure the entries' times differ, then use the first one.
+        past = time.time() - 100
+        os.utime(os.path.join(self.cache.directory, 'first'), (past, past))
+        os.utime(os.path.join(self.cache.directory, 'second'), (past, past))
+        self.cache.get('first', 'first.whl', self.destination)
+        self.cache.put('third', self._wheel('third.whl'))
+        self.assertEqual(sorted(os.listdir(self.cache.directory)),
+                         ['first', 'third'])
+
+
+def _fail(*args):
+    raise OSError(errno.EXDEV, 'Nope')
+
+
+class TestLinkOrCopy(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.src = os.path.join(tempdir.name, 'src.whl')
+        self.dst = os.path.join(tempdir.name, 'dst.whl')
+        with open(self.src, 'wb') as fp:
+            fp.write(b'wheel' * 1000)
+
+    def _check(self, expected_mode):
+        mode = _link_or_copy(self.src, self.dst)
+        self.assertEqual(mode, expected_mode)
+        with open(self.dst, 'rb') as fp:
+            self.assertEqual(fp.read(), b'wheel' * 1000)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.dst))),
+                         ['dst.whl', 'src.whl'])
+
+    def test_hardlink(self):
+        self._check('hardlink')
+        self.assertTrue(os.path.samefile(self.src, self.dst))
+
+    @mock.patch('os.link', _fail)
+    def test_reflink(self):
+        # Whether a reflink is possible depends on the file system, so
+        # pretend.
+        def ioctl(fd, request, src_fd):
+            self.assertEqual(request, cache.FICLONE)
+            os.write(fd, os.read(src_fd, 1024 * 1024))
+        with mock.patch.object(cache, 'fcntl') as fcntl:
+            fcntl.ioctl.side_effect = ioctl
+            self._check('reflink')
+        self.assertTrue(fcntl.ioctl.called)
+
+    @mock.patch('os.link', _fail)
+    @mock.patch('dirtbike.cache.fcntl', None)
+    def test_copy_file_range(self):
+        if not hasattr(os, 'copy_file_range'):
+            self.skipTest('No os.copy_file_range()')
+        self._check('copy_file_range')
+
+    @mock.patch('os.link', _fail)
+    @mock.patch('dirtbike.cache.fcntl', None)
+    def test_copy(self):
+        with mock.patch('os.copy_file_range', _fail, create=True):
+            self._check('copy')
@@ -0,0 +1,105 @@
+import os
+import sys
+import unittest
+
+from dirtbike.callout import (
+    Callout, CalloutError, get_callout, reset_callout)
+from dirtbike.testing.helpers import temporary_directory
+from dirtbike.timings import get_timings
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+MODULES = {
+    # Anything printed on import mustn't be mistaken for an answer.
+    'noisy.py': 'print("noisy")\n',
+    'broken.py': 'raise ValueError("broken")\n',
+    'fatal.py': 'import os\nos._exit(3)\n',
+    }
+
+
+class TestCallout(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.directory = tempdir.name
+        for filename, contents in MODULES.items():
+            with open(os.path.join(self.directory, filename), 'w') as fp:
+                fp.write(contents)
+        # The helper inherits the environment when it starts.
+        environ = mock.patch.dict(os.environ, PYTHONPATH=self.directory)
+        environ.start()
+        self.addCleanup(environ.stop)
+        # Use this interpreter as the "other" one, since that's the only one
+        # we can be sure of.
+        self.callout = Callout(sys.executable)
+        self.addCleanup(self.callout.close)
+        get_timings().reset()
+
+    def test_find(self):
+        noisy, broken, missing = self.callout.find(
+            ['noisy', 'broken', 'dirtbike_no_such_module'])
+        self.assertEqual(noisy.file,
+                         os.path.join(self.directory, 'noisy.py'))
+        self.assertIsNone(noisy.error)
+        self.assertIsNone(broken.file)
+        self.assertIn('ValueError: broken', broken.error)
+        self.assertIsNone(missing.file)
+        self.assertIn('dirtbike_no_such_module', missing.error)
+        # The helper is still going, and only one was ever started.
+        answer, = self.callout.find(['os'])
+        self.assertEqual(os.path.splitext(answer.file)[0],
+                         os.path.splitext(os.__file__)[0])
+        counters = get_timings().as_dict()['counters']
+        self.assertEqual(counters['subprocesses'], 1)
+        self.assertEqual(counters['callouts'], 4)
+
+    def test_answers_are_remembered(self):
+        first = self.callout.find(['noisy'])
+        self.assertEqual(self.callout.find(['noisy', 'noisy']), first * 2)
+        self.assertEqual(get_timings().as_dict()['counters']['callouts'], 1)
+
+    def test_helper_dies(self):
+        noisy, fatal, broken = self.callout.find(['noisy', 'fatal', 'broken'])
+        self.assertIsNotNone(noisy.file)
+        self.assertIn('exited with status 3', fatal.error)
+        self.assertIn('exited with status 3', broken.error)
+        # The next question starts a new helper, which gets another go.
+        broken, = self.callout.find(['broken'])
+        self.assertIn('ValueError: broken', broken.error)
+        counters = get_timings().as_dict()['counters']
+        self.assertEqual(counters['subprocesses'], 2)
+
+    def test_closed(self):
+        noisy, = self.callout.find(['noisy'])
+        self.callout.close()
+        # What it's already been told is still known, but nothing else.
+        self.assertEqual(self.callout.find(['noisy']), [noisy])
+        with mock.patch('subprocess.Popen') as popen:
+            with self.assertRaises(CalloutError):
+                self.callout.find(['broken'])
+        self.assertEqual(popen.call_count, 0)
+
+    def test_reset(self):
+        # Resetting closes the process-wide helper, and the next one asked
+        # for is a new one.
+        reset_callout()
+        self.addCleanup(reset_callout)
+        with mock.patch('dirtbike.callout.Callout',
+                        side_effect=lambda: mock.Mock(pid=os.getpid())):
+            old = get_callout()
+            reset_callout()
+            self.assertIsNot(get_callout(), old)
+        old.close.assert_called_once_with()
+
+    def test_no_interpreter(self):
+        callout = Callout(os.path.join(self.directory, 'python'))
+        with mock.patch('subprocess.Popen', side_effect=OSError) as popen:
+            for attempt in range(2):
+                with self.assertRaises(CalloutError):
+                    callout.find(['os'])
+        # There's no point trying again.
+        self.assertEqual(popen.call_count, 1)
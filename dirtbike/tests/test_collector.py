@@ -0,0 +1,58 @@
+import os
+import unittest
+
+from dirtbike.collector import collect
+from dirtbike.testing.helpers import temporary_directory
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    # Python 2.
+    from mock import patch
+
+
+class TestCollect(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.site = os.path.join(tempdir.name, 'site-packages')
+        for filename in (
+                'stupid/__init__.py',
+                'stupid/__init__.pyc',
+                'stupid/__pycache__/__init__.cpython-35.pyc',
+                'stupid-2.0.dist-info/METADATA',
+                '../bin/stupid',
+                ):
+            path = os.path.normpath(os.path.join(self.site, filename))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write('stupid\n')
+
+    def test_collect(self):
+        with patch('dirtbike.collector.print', create=True) as mock_print:
+            installed = list(collect([
+                '',
+                'stupid',
+                'stupid/__init__.py',
+                'stupid/__init__.pyc',
+                'stupid/__pycache__/__init__.cpython-35.pyc',
+                'stupid/missing.py',
+                'stupid-2.0.dist-info/METADATA',
+                '../bin/stupid',
+                os.path.join(self.site, 'stupid', '__init__.py'),
+                ], self.site))
+        self.assertEqual([info.path for info in installed], [
+            os.path.join(self.site, 'stupid', '__init__.py'),
+            os.path.join(self.site, 'stupid-2.0.dist-info', 'METADATA'),
+            os.path.join(self.site, 'stupid', '__init__.py'),
+            ])
+        self.assertEqual(installed[0].size, 7)
+        # The missing file and the one outside the location are warned about.
+        self.assertEqual(mock_print.call_count, 2)
+
+    def test_stat_once(self):
+        with patch('dirtbike.collector.os.stat', wraps=os.stat) as mock_stat:
+            list(collect(['stupid', 'stupid/__init__.py',
+                          'stupid-2.0.dist-info/METADATA'], self.site))
+        self.assertEqual(mock_stat.call_count, 3)
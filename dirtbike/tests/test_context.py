@@ -0,0 +1,135 @@
+import os
+import unittest
+
+from dirtbike.context import Context, normalize
+from dirtbike.testing.helpers import temporary_directory
+
+
+class TestContext(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.first = os.path.join(tempdir.name, 'first')
+        self.second = os.path.join(tempdir.name, 'second')
+        for filename in (
+                'first/package/__init__.py',
+                'first/module.py',
+                'first/module.pyc',
+                'first/namespace/module.py',
+                'first/not.a.module.py',
+                'second/package.py',
+                'second/other.py',
+                ):
+            path = os.path.join(tempdir.name, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w'):
+                pass
+        self.context = Context([self.first, self.second])
+
+    def test_package(self):
+        module = self.context.module('package')
+        self.assertTrue(module.is_package)
+        self.assertEqual(module.path, os.path.join(self.first, 'package'))
+
+    def test_source_preferred(self):
+        module = self.context.module('module')
+        self.assertFalse(module.is_package)
+        self.assertEqual(module.path, os.path.join(self.first, 'module.py'))
+
+    def test_path_order(self):
+        self.assertEqual(self.context.module('other').path,
+                         os.path.join(self.second, 'other.py'))
+
+    def test_not_modules(self):
+        self.assertIsNone(self.context.module('namespace'))
+        self.assertIsNone(self.context.module('not'))
+        self.assertIsNone(self.context.module('missing'))
+
+    def test_distribution(self):
+        # pip is always installed in the test environment.
+        context = Context()
+        self.assertEqual(context.distribution('PIP').project_name, 'pip')
+        self.assertIsNone(context.distribution('dirtbike-no-such-thing'))
+
+    def test_stale(self):
+        self.context.load()
+        self.assertFalse(self.context.is_stale())
+        past = os.stat(self.second).st_mtime - 100
+        os.utime(self.second, (past, past))
+        self.assertTrue(self.context.is_stale())
+
+    def test_normalize(self):
+        self.assertEqual(normalize('Foo.Bar__baz'), 'foo-bar-baz')
+
+
+class TestInstalledDistribution(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.site = tempdir.name
+        for filename, contents in (
+                ('stupid-2.0.egg-info/PKG-INFO',
+                 'Metadata-Version: 1.1\nName: stupid\nVersion: 2.0\n'),
+                ('stupid-2.0.egg-info/requires.txt',
+                 'six\n\n[test]\nnose2\n'),
+                ('stupid-2.0.egg-info/installed-files.txt',
+                 '../stupid/__init__.py\nPKG-INFO\n../../../bin/stupid\n'),
+                ('smart_thing-1.0.dist-info/METADATA',
+                 'Metadata-Version: 2.1\nName: smart-thing\nVersion: 1.0\n'
+                 'Requires-Dist: stupid (>=2.0)\n'),
+                ('smart_thing-1.0.dist-info/RECORD',
+                 'smart.py,sha256=abc,10\n"smart,er.py",,\n'
+                 'smart_thing-1.0.dist-info/RECORD,,\n'),
+                ):
+            path = os.path.join(self.site, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(contents)
+        self.context = Context([self.site])
+
+    def test_installed_files(self):
+        distribution = self.context.distribution('stupid')
+        self.assertEqual(distribution.project_name, 'stupid')
+        self.assertEqual(distribution.version, '2.0')
+        self.assertEqual(distribution.location, self.site)
+        self.assertEqual(distribution.files(), [
+            os.path.join('stupid', '__init__.py'),
+            os.path.join('stupid-2.0.egg-info', 'PKG-INFO'),
+            os.path.join('..', '..', 'bin', 'stupid'),
+            ])
+
+    def test_record(self):
+        distribution = self.context.distribution('Smart.Thing')
+        self.assertEqual(distribution.project_name, 'smart-thing')
+        self.assertEqual(distribution.files(), [
+            'smart.py',
+            'smart,er.py',
+            'smart_thing-1.0.dist-info/RECORD',
+            ])
+
+    def test_iter_files(self):
+        distribution = self.context.distribution('smart-thing')
+        files = distribution.iter_files()
+        self.assertEqual(next(files), 'smart.py')
+        self.assertEqual(list(files), [
+            'smart,er.py',
+            'smart_thing-1.0.dist-info/RECORD',
+            ])
+
+    def test_requires(self):
+        self.assertEqual(
+            self.context.distribution('smart-thing').requires(),
+            ['stupid (>=2.0)'])
+        requires = self.context.distribution('stupid').requires()
+        self.assertEqual(requires[0], 'six')
+        # Whether the extras are included depends on whether pkg_resources
+        # or importlib.metadata read them.
+        self.assertIn(requires[1:], ([], ['nose2; extra == "test"']))
+
+    def test_distributions(self):
+        self.assertEqual(
+            [distribution.project_name
+             for distribution in self.context.distributions()],
+            ['smart-thing', 'stupid'])
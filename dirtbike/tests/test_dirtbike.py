@@ -8,15 +8,14 @@ import unittest
 
 from dirtbike.testing.helpers import (
     call, chdir, output, temporary_directory)
-from dirtbike.testing.schroot import Session
+from dirtbike.testing.schroot import SessionLayer, prepared_session
 from glob import glob
 from pkg_resources import resource_filename
 
 
-KEEP_SESSIONS = os.getenv('DIRTBIKE_DEBUG_SESSIONS')
-
-
 class TestDirtbike(unittest.TestCase):
+    layer = SessionLayer
+
     def setUp(self):
         base_dir = os.path.abspath(os.path.dirname(
             resource_filename('dirtbike.tests', '__init__.py')))
@@ -28,44 +27,11 @@ class TestDirtbike(unittest.TestCase):
         for filename in glob('./*.whl'):
             os.remove(filename)
 
-    def _start_session(self, install=True):
-        self.session = Session()
-        self.session.start()
-        # Convenience so the caller doesn't have to tear down the
-        # session, unless it's being explicitly preserved.
-        if KEEP_SESSIONS:
-            print()
-            print()
-            print('KEEPING SESSION:', self.session.id, file=sys.stderr)
-            print()
-        else:
-            self.addCleanup(self.session.end)
-        if install:
-            self.session.call(
-                [self.python, 'setup.py', 'install'],
-                env=dict(LC_ALL='en_US.UTF-8'))
-
-    def _install_example(self):
-        with chdir(self.example_dir):
-            call([
-                self.python,
-                'setup.py', '--no-user-cfg',
-                '--command-packages=stdeb.command',
-                'bdist_deb'
-                ])
-            # bdist_deb can't be told where to leave its artifacts, so
-            # make sure that cruft gets cleaned up after this test.
-            dist_dir = os.path.join(self.example_dir, 'deb_dist')
-            self.addCleanup(shutil.rmtree, os.path.join(dist_dir))
-            tar_gzs = glob(os.path.join(self.example_dir, '*.tar.gz'))
-            if len(tar_gzs) > 0:
-                assert len(tar_gzs) == 1, tar_gzs
-                self.addCleanup(os.remove, tar_gzs[0])
-            # Install the .deb and all its dependencies in the schroot.
-            debs = glob(os.path.join(dist_dir, '*.deb'))
-            self.assertEqual(len(debs), 1)
-            deb = debs[0]
-            self.session.call(['gdebi', '-n', deb])
+    def _start_session(self):
+        # Every test shares the one session, which already has dirtbike and
+        # the example .deb installed.  Undo whatever the last test did to it.
+        self.session = prepared_session()
+        self.session.reset()
 
     def test_sanity_check_wheel(self):
         # Sanity check that the setUpClass() created the wheel, that it can be
@@ -94,7 +60,6 @@ class TestDirtbike(unittest.TestCase):
         # Create a .deb, install it into a chroot, then turn it back
         # into a wheel and verify the contents.
         self._start_session()
-        self._install_example()
         # Verify the .deb installed package.
         result = self.session.output(
             [self.python, '-c', 'import stupid; stupid.yes()'])
@@ -150,7 +115,6 @@ class TestDirtbike(unittest.TestCase):
     def test_directory(self):
         # Test the -d option.
         self._start_session()
-        self._install_example()
         # Verify the .deb installed package.
         result = self.session.output(
             [self.python, '-c', 'import stupid; stupid.yes()'])
@@ -178,7 +142,6 @@ class TestDirtbike(unittest.TestCase):
     def test_dirtbike_directory_envar(self):
         # Test the $DIRTBIKE_DIRECTORY environment variable.
         self._start_session()
-        self._install_example()
         # Verify the .deb installed package.
         result = self.session.output(
             [self.python, '-c', 'import stupid; stupid.yes()'])
@@ -207,7 +170,6 @@ class TestDirtbike(unittest.TestCase):
         # Test that the -d option overrides the $DIRTBIKE_DIRECTORY
         # environment variable.
         self._start_session()
-        self._install_example()
         # Verify the .deb installed package.
         result = self.session.output(
             [self.python, '-c', 'import stupid; stupid.yes()'])
@@ -303,7 +265,6 @@ class TestDirtbike(unittest.TestCase):
         # called install_egg_info which deletes the entire .egg-info
         # directory!  Make sure this doesn't happen.
         self._start_session()
-        self._install_example()
         # Use dirtbike in the schroot to turn the installed package back into a
         # whl.  To verify it, we'll purge the deb and run the package test with
         # the .whl in sys.path.
@@ -0,0 +1,148 @@
+from __future__ import print_function
+
+import os
+import unittest
+
+from dirtbike.dpkg import DpkgIndex, DpkgLookupError
+from dirtbike.strategy import _DpkgBaseStrategy
+from dirtbike.testing.helpers import temporary_directory
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    # Python 2.
+    from mock import patch
+
+
+SITE = '/usr/lib/python3/dist-packages'
+
+LISTS = {
+    'python3-stupid': [
+        '/.',
+        '/usr',
+        '/usr/lib',
+        '/usr/lib/python3',
+        SITE,
+        SITE + '/stupid',
+        SITE + '/stupid/__init__.py',
+        SITE + '/stupid-2.0.egg-info',
+        SITE + '/stupid-2.0.egg-info/PKG-INFO',
+        '/usr/share/doc/python3-stupid/copyright',
+        ],
+    'libstupid:amd64': [
+        '/.',
+        '/usr',
+        '/usr/lib',
+        '/usr/lib/libstupid.so.2',
+        ],
+    }
+
+
+class TestDpkgIndex(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.info_dir = os.path.join(tempdir.name, 'info')
+        os.mkdir(self.info_dir)
+        for package, paths in LISTS.items():
+            list_file = os.path.join(self.info_dir, package + '.list')
+            with open(list_file, 'w') as fp:
+                for path in paths:
+                    print(path, file=fp)
+        # Other files in the dpkg database have to be ignored.
+        with open(os.path.join(self.info_dir, 'python3-stupid.md5sums'),
+                  'w') as fp:
+            print('d41d8cd98f00b204e9800998ecf8427e  usr/bin/stupid', file=fp)
+        self.status_file = os.path.join(tempdir.name, 'status')
+        with open(self.status_file, 'w') as fp:
+            print('Package: python3-stupid', file=fp)
+        self.cache_file = os.path.join(tempdir.name, 'cache', 'index')
+        self.index = DpkgIndex(self.info_dir)
+
+    def test_owner(self):
+        self.assertEqual(
+            self.index.owner(SITE + '/stupid/__init__.py'), 'python3-stupid')
+
+    def test_owner_multiarch(self):
+        self.assertEqual(
+            self.index.owner('/usr/lib/libstupid.so.2'), 'libstupid:amd64')
+
+    def test_owner_shared_directory(self):
+        # Directories are often owned by several packages.  Like dpkg, we
+        # report one of them rather than failing.
+        self.assertIn(self.index.owner('/usr/lib'), LISTS)
+
+    def test_not_owned(self):
+        self.assertRaises(DpkgLookupError,
+                          self.index.owner, '/usr/bin/stupid')
+
+    def test_files(self):
+        self.assertEqual(self.index.files('python3-stupid'),
+                         LISTS['python3-stupid'])
+
+    def test_files_not_installed(self):
+        self.assertRaises(DpkgLookupError, self.index.files, 'python3-smart')
+
+    def test_undecodable_path(self):
+        # dpkg doesn't care what encoding file names are in.
+        with open(os.path.join(self.info_dir, 'fonts-cafe.list'), 'wb') as fp:
+            fp.write(b'/usr/share/fonts/caf\xe9.ttf\n')
+        self.assertEqual(
+            self.index.owner(SITE + '/stupid/__init__.py'), 'python3-stupid')
+        self.assertEqual(len(self.index.files('fonts-cafe')), 1)
+
+    def test_find_files_relative_to(self):
+        with patch('dirtbike.strategy.get_index', return_value=self.index):
+            files = list(_DpkgBaseStrategy()._find_files(
+                SITE + '/stupid-2.0.egg-info', SITE))
+        self.assertEqual(files, [
+            'stupid',
+            'stupid/__init__.py',
+            'stupid-2.0.egg-info',
+            'stupid-2.0.egg-info/PKG-INFO',
+            ])
+
+    def test_cache_reused(self):
+        DpkgIndex(self.info_dir, self.cache_file).load()
+        self.assertTrue(os.path.exists(self.cache_file))
+        # With the cache in place, the *.list files aren't read at all.
+        index = DpkgIndex(self.info_dir, self.cache_file)
+        with patch.object(index, '_read_lists') as read_lists:
+            self.assertEqual(
+                index.owner(SITE + '/stupid/__init__.py'), 'python3-stupid')
+        self.assertFalse(read_lists.called)
+
+    def test_cache_invalidated(self):
+        DpkgIndex(self.info_dir, self.cache_file).load()
+        # Installing a package changes the status file.
+        with open(os.path.join(self.info_dir, 'python3-smart.list'),
+                  'w') as fp:
+            print(SITE + '/smart.py', file=fp)
+        with open(self.status_file, 'a') as fp:
+            print('Package: python3-smart', file=fp)
+        index = DpkgIndex(self.info_dir, self.cache_file)
+        self.assertEqual(index.owner(SITE + '/smart.py'), 'python3-smart')
+
+    def test_stale(self):
+        self.assertFalse(self.index.is_stale())
+        self.index.load()
+        self.assertFalse(self.index.is_stale())
+        with open(self.status_file, 'a') as fp:
+            print('Package: python3-smart', file=fp)
+        self.assertTrue(self.index.is_stale())
+
+    def test_load_once(self):
+        with patch.object(self.index, '_read_lists',
+                          wraps=self.index._read_lists) as read_lists:
+            self.index.load()
+            self.index.load()
+            self.index.owner('/usr/lib/libstupid.so.2')
+        self.assertEqual(read_lists.call_count, 1)
+
+    def test_corrupt_cache(self):
+        os.mkdir(os.path.dirname(self.cache_file))
+        with open(self.cache_file, 'wb') as fp:
+            fp.write(b'this is not a marshal file')
+        index = DpkgIndex(self.info_dir, self.cache_file)
+        self.assertEqual(
+            index.owner(SITE + '/stupid/__init__.py'), 'python3-stupid')
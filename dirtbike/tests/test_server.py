@@ -0,0 +1,134 @@
+import os
+import unittest
+import threading
+
+from dirtbike.batch import Result
+from dirtbike.server import (
+    Daemon, DaemonError, _Handler, _Server, build, request)
+from dirtbike.testing.helpers import temporary_directory
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def _build_one(work):
+    name, directory, cache, options = work
+    if name == 'broken':
+        return Result(name, None, 'Traceback: broken\n')
+    return Result(name, os.path.join(directory, name + '.whl'), None)
+
+
+@mock.patch('dirtbike.batch._build_one', _build_one)
+@mock.patch('dirtbike.server.preload', lambda: None)
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.directory = tempdir.name
+        self.socket_path = os.path.join(tempdir.name, 'dirtbike.sock')
+        self.daemon = Daemon()
+        server = _Server(self.socket_path, _Handler)
+        server.daemon = self.daemon
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def test_build(self):
+        results = build(self.socket_path, ['stupid', 'broken'],
+                        self.directory, cache=False)
+        self.assertEqual(results, [
+            Result('stupid', os.path.join(self.directory, 'stupid.whl'),
+                   None),
+            Result('broken', None, 'Traceback: broken\n'),
+            ])
+
+    def test_relative_directory(self):
+        # The client makes the directory absolute, since the daemon's
+        # current directory is nothing to do with the client's.
+        with mock.patch('os.getcwd', return_value=self.directory):
+            results = build(self.socket_path, ['stupid'], cache=False)
+        self.assertEqual(results[0].wheel,
+                         os.path.join(self.directory, 'stupid.whl'))
+
+    def test_socket_permissions(self):
+        # Nobody else may ask the daemon to write files.
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o777, 0o600)
+
+    def test_relative_site(self):
+        site = os.path.join(self.directory, 'site-packages')
+        with mock.patch('os.getcwd', return_value=self.directory), \
+                mock.patch('dirtbike.server.site_distributions',
+                           return_value=[]) as site_distributions:
+            build(self.socket_path, [], cache=False, everything=True,
+                  site='site-packages')
+        site_distributions.assert_called_once_with(site)
+
+    def test_error(self):
+        with self.assertRaises(DaemonError) as cm:
+            request(self.socket_path, dict(packages=['stupid'],
+                                           directory='relative'))
+        self.assertIn('must be an absolute path', str(cm.exception))
+
+
+class TestDaemonRefresh(unittest.TestCase):
+    def setUp(self):
+        self.context = mock.Mock()
+        self.context.is_stale.return_value = False
+        self.index = mock.Mock()
+        self.index.is_stale.return_value = False
+        self.pools = []
+
+        def fresh_pool(jobs, initializer):
+            self.pools.append(mock.Mock())
+            return self.pools[-1]
+        for patcher in (
+                mock.patch('dirtbike.server.get_context',
+                           return_value=self.context),
+                mock.patch('dirtbike.server.get_index',
+                           return_value=self.index),
+                mock.patch('dirtbike.server.reset_context'),
+                mock.patch('dirtbike.server.reset_index'),
+                mock.patch('dirtbike.server.reset_callout'),
+                ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('dirtbike.server.preload')
+        self.preload = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('dirtbike.server.fresh_pool',
+                             side_effect=fresh_pool)
+        self.fresh_pool = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.daemon = Daemon(jobs=2)
+
+    def test_pool_reused(self):
+        with self.daemon._checkout() as first:
+            pass
+        with self.daemon._checkout() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(len(self.pools), 1)
+
+    def test_stale(self):
+        with self.daemon._checkout() as first:
+            # Installing something makes the lookups stale while a request
+            # is using the pool.
+            self.context.is_stale.return_value = True
+            with self.daemon._checkout() as second:
+                self.context.is_stale.return_value = False
+                self.assertIsNot(first, second)
+                # The first request still has its pool.
+                self.assertFalse(first.close.called)
+        # Once it's done, the old pool is closed, but not the new one.
+        first.close.assert_called_once_with()
+        self.assertFalse(second.close.called)
+        # The workers load the new lookups themselves, rather than being
+        # forked with them.
+        self.assertEqual(self.fresh_pool.call_args_list,
+                         [mock.call(2, self.preload)] * 2)
+        self.daemon.close()
+        second.terminate.assert_called_once_with()
@@ -0,0 +1,37 @@
+import unittest
+
+from dirtbike.strategy import (
+    DpkgEggStrategy, DpkgImportlibStrategy, MetadataStrategy)
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    # Python 2.
+    from mock import patch
+
+
+class TestLazyStrategies(unittest.TestCase):
+    # pip is always installed in the test environment, from a wheel.
+
+    def test_probe_does_not_list_files(self):
+        strategy = MetadataStrategy('pip')
+        with patch.object(MetadataStrategy, '_list_files') as list_files:
+            self.assertTrue(strategy.can_succeed)
+        self.assertFalse(list_files.called)
+
+    def test_files_are_listed_once(self):
+        strategy = MetadataStrategy('pip')
+        with patch.object(MetadataStrategy, '_list_files',
+                          return_value=['pip/__init__.py']) as list_files:
+            self.assertEqual(strategy.files, ['pip/__init__.py'])
+            self.assertEqual(strategy.files, ['pip/__init__.py'])
+        self.assertEqual(list_files.call_count, 1)
+
+    def test_cannot_succeed(self):
+        for strategy_class in (MetadataStrategy, DpkgEggStrategy,
+                               DpkgImportlibStrategy):
+            strategy = strategy_class('dirtbike_no_such_distribution')
+            with patch.object(strategy_class, '_list_files') as list_files:
+                self.assertFalse(strategy.can_succeed)
+                self.assertIsNone(strategy.files)
+            self.assertFalse(list_files.called)
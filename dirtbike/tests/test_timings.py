@@ -0,0 +1,45 @@
+import json
+import unittest
+
+from dirtbike.timings import Timings
+
+
+class TestTimings(unittest.TestCase):
+    def test_phases_and_counters(self):
+        timings = Timings()
+        with timings.phase('write'):
+            pass
+        with timings.phase('write'):
+            pass
+        timings.count('files_considered', 3)
+        timings.count('files_considered')
+        data = timings.as_dict()
+        self.assertEqual(data['phases']['write']['calls'], 2)
+        self.assertGreaterEqual(data['phases']['write']['seconds'], 0)
+        self.assertEqual(data['counters'], {'files_considered': 4})
+        # It's all JSON serializable.
+        self.assertEqual(json.loads(json.dumps(data)), data)
+
+    def test_merge(self):
+        worker = Timings()
+        worker.add_time('write', 2.0)
+        worker.count('distributions')
+        timings = Timings()
+        timings.add_time('write', 1.0)
+        timings.merge(worker.as_dict())
+        timings.merge(worker.as_dict())
+        data = timings.as_dict()
+        self.assertEqual(data['phases']['write'],
+                         dict(seconds=5.0, calls=3))
+        self.assertEqual(data['counters'], {'distributions': 2})
+
+    def test_table(self):
+        timings = Timings()
+        timings.add_time('hash', 1.0)
+        timings.add_time('write', 2.0)
+        timings.count('bytes_read', 42)
+        lines = timings.format_table().splitlines()
+        # Slowest phase first.
+        self.assertTrue(lines[1].startswith('write '))
+        self.assertTrue(lines[2].startswith('hash '))
+        self.assertEqual(lines[-1].split(), ['bytes_read', '42'])
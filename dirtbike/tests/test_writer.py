@@ -0,0 +1,381 @@
+import os
+import sys
+import base64
+import hashlib
+import unittest
+
+from dirtbike.bytecode import compile_pool, compiled_name
+from dirtbike.collector import installed_file
+from dirtbike.testing.helpers import temporary_directory
+from dirtbike.timings import Timings
+from dirtbike.writer import WheelWriter, source_date_epoch
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    # Python 2.
+    from mock import patch
+
+
+PKG_INFO = """\
+Metadata-Version: 1.1
+Name: stupid
+Version: 2.0
+Summary: A stupid example
+"""
+
+FILES = {
+    'stupid/__init__.py': 'def yes():\n    print("yes")\n',
+    'stupid/__main__.py': 'from stupid import yes\nyes()\n',
+    'stupid-2.0.egg-info/PKG-INFO': PKG_INFO,
+    'stupid-2.0.egg-info/entry_points.txt':
+        '[console_scripts]\nstupid = stupid:yes\n',
+    'stupid-2.0.egg-info/requires.txt': (
+        'six\n\n'
+        '[:python_version < "3"]\nmock\n\n'
+        '[test]\nnose2\n\n'
+        '[docs:sys_platform == "linux"]\nsphinx\n'),
+    'stupid-2.0.egg-info/SOURCES.txt': 'setup.py\n',
+    'stupid-2.0.egg-info/dependency_links.txt': '\n',
+    }
+
+
+class TestWheelWriter(unittest.TestCase):
+    def setUp(self):
+        tempdir = temporary_directory()
+        self.addCleanup(tempdir.cleanup)
+        self.site = os.path.join(tempdir.name, 'site-packages')
+        self.dist_dir = os.path.join(tempdir.name, 'dist')
+        os.mkdir(self.dist_dir)
+        for filename, contents in FILES.items():
+            path = os.path.join(self.site, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(contents)
+
+    def _write(self, filenames, **kws):
+        writer = WheelWriter('stupid', '2.0', self.site, **kws)
+        for filename in sorted(filenames):
+            writer.add(os.path.join(self.site, filename))
+        return writer.write(self.dist_dir)
+
+    def test_members(self):
+        wheel = self._write(FILES)
+        self.assertEqual(os.path.basename(wheel),
+                         'stupid-2.0-py2.py3-none-any.whl')
+        with ZipFile(wheel) as zf:
+            names = zf.namelist()
+        # The .egg-info is converted into a .dist-info, which goes last.
+        self.assertEqual(names, [
+            'stupid/__init__.py',
+            'stupid/__main__.py',
+            'stupid-2.0.dist-info/entry_points.txt',
+            'stupid-2.0.dist-info/METADATA',
+            'stupid-2.0.dist-info/WHEEL',
+            'stupid-2.0.dist-info/RECORD',
+            ])
+        # Nothing is left behind in the destination.
+        self.assertEqual(os.listdir(self.dist_dir), [os.path.basename(wheel)])
+
+    def test_add_files(self):
+        consumed = []
+
+        def installed():
+            for filename in sorted(FILES):
+                if filename != 'stupid/__main__.py':
+                    consumed.append(filename)
+                    yield installed_file(os.path.join(self.site, filename))
+        writer = WheelWriter('stupid', '2.0', self.site)
+        writer.add(os.path.join(self.site, 'stupid', '__main__.py'))
+        writer.add_files(installed())
+        # Nothing is found until the wheel is written.
+        self.assertEqual(consumed, [])
+        wheel = writer.write(self.dist_dir)
+        self.assertEqual(len(consumed), len(FILES) - 1)
+        with ZipFile(wheel) as zf:
+            names = zf.namelist()
+        self.assertEqual(names[:2],
+                         ['stupid/__init__.py', 'stupid/__main__.py'])
+
+    def test_add_files_timed(self):
+        # Finding the files is timed, even though it happens in write().
+        timings = Timings()
+        writer = WheelWriter('stupid', '2.0', self.site)
+        writer.add_files(installed_file(os.path.join(self.site, filename))
+                         for filename in sorted(FILES))
+        with patch('dirtbike.writer.get_timings', return_value=timings):
+            writer.write(self.dist_dir)
+        self.assertEqual(timings.as_dict()['phases']['collect']['calls'], 1)
+
+    def test_duplicates(self):
+        # The same file can be listed more than once, but it only goes into
+        # the wheel, and RECORD, once.
+        writer = WheelWriter('stupid', '2.0', self.site)
+        main = os.path.join(self.site, 'stupid', '__main__.py')
+        writer.add(main)
+        writer.add_files(installed_file(os.path.join(self.site, filename))
+                         for filename in sorted(FILES))
+        writer.add(main)
+        wheel = writer.write(self.dist_dir)
+        with ZipFile(wheel) as zf:
+            names = zf.namelist()
+            record = zf.read('stupid-2.0.dist-info/RECORD').decode('utf-8')
+        self.assertEqual(names.count('stupid/__main__.py'), 1)
+        self.assertEqual(record.count('stupid/__main__.py,'), 1)
+
+    def test_metadata(self):
+        wheel = self._write(FILES)
+        with ZipFile(wheel) as zf:
+            metadata = zf.read('stupid-2.0.dist-info/METADATA').decode('utf-8')
+            entry_points = zf.read(
+                'stupid-2.0.dist-info/entry_points.txt').decode('utf-8')
+        self.assertIn('Name: stupid\n', metadata)
+        self.assertIn('Version: 2.0\n', metadata)
+        # requires.txt is converted into the metadata.
+        self.assertIn('Requires-Dist: six\n', metadata)
+        self.assertIn('Requires-Dist: mock; python_version < "3"\n',
+                      metadata)
+        self.assertIn('Provides-Extra: test\n', metadata)
+        self.assertIn('Requires-Dist: nose2; extra == "test"\n', metadata)
+        self.assertIn('Requires-Dist: sphinx; (sys_platform == "linux") '
+                      'and extra == "docs"\n', metadata)
+        self.assertEqual(entry_points, FILES[
+            'stupid-2.0.egg-info/entry_points.txt'])
+
+    def test_other_egg_info(self):
+        # A plugin's metadata, shipped in the same Debian package, doesn't
+        # get mixed up with the distribution's own.
+        plugin = {
+            'stupid_plugin/__init__.py': '',
+            'stupid_plugin-1.0.egg-info/PKG-INFO':
+                PKG_INFO.replace('stupid', 'stupid-plugin'),
+            'stupid_plugin-1.0.egg-info/entry_points.txt':
+                '[stupid.plugins]\nplugin = stupid_plugin\n',
+            }
+        for filename, contents in plugin.items():
+            path = os.path.join(self.site, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(contents)
+        for kws in ({}, dict(metadata_dir='stupid-2.0.egg-info')):
+            wheel = self._write(list(FILES) + list(plugin), **kws)
+            with ZipFile(wheel) as zf:
+                names = zf.namelist()
+                metadata = zf.read(
+                    'stupid-2.0.dist-info/METADATA').decode('utf-8')
+                entry_points = zf.read(
+                    'stupid-2.0.dist-info/entry_points.txt').decode('utf-8')
+            os.remove(wheel)
+            self.assertEqual(len(names), len(set(names)))
+            self.assertIn('stupid_plugin/__init__.py', names)
+            self.assertFalse(any(name.startswith('stupid_plugin-1.0')
+                                 for name in names))
+            self.assertIn('Name: stupid\n', metadata)
+            self.assertEqual(entry_points, FILES[
+                'stupid-2.0.egg-info/entry_points.txt'])
+
+    def test_no_egg_info(self):
+        wheel = self._write(['stupid/__init__.py'])
+        with ZipFile(wheel) as zf:
+            metadata = zf.read('stupid-2.0.dist-info/METADATA').decode('utf-8')
+        self.assertIn('Name: stupid\n', metadata)
+        self.assertIn('Version: 2.0\n', metadata)
+
+    def test_record(self):
+        wheel = self._write(FILES)
+        with ZipFile(wheel) as zf:
+            record = zf.read('stupid-2.0.dist-info/RECORD').decode('utf-8')
+            rows = [line.split(',') for line in record.splitlines()]
+            self.assertEqual(len(rows), len(zf.namelist()))
+            for name, digest, size in rows:
+                if name == 'stupid-2.0.dist-info/RECORD':
+                    self.assertEqual((digest, size), ('', ''))
+                    continue
+                data = zf.read(name)
+                expected = base64.urlsafe_b64encode(
+                    hashlib.sha256(data).digest()).rstrip(b'=')
+                self.assertEqual(digest, 'sha256=' + expected.decode('ascii'))
+                self.assertEqual(int(size), len(data))
+
+    def test_record_hash_threads(self):
+        # Hashing in a thread pool gives the same RECORD, in the same order,
+        # as hashing in the writing thread.
+        records = []
+        for hash_threads in (0, 4):
+            wheel = self._write(FILES, hash_threads=hash_threads)
+            with ZipFile(wheel) as zf:
+                records.append(zf.read('stupid-2.0.dist-info/RECORD'))
+        self.assertEqual(records[0], records[1])
+
+    def test_reproducible(self):
+        # The same files give the same bytes, whatever order they're found
+        # in.
+        contents = []
+        for reverse in (False, True):
+            writer = WheelWriter('stupid', '2.0', self.site)
+            for filename in sorted(FILES, reverse=reverse):
+                writer.add(os.path.join(self.site, filename))
+            wheel = writer.write(self.dist_dir)
+            with open(wheel, 'rb') as fp:
+                contents.append(fp.read())
+            os.remove(wheel)
+        self.assertEqual(contents[0], contents[1])
+
+    def test_timestamp(self):
+        # Every member has the newest file's modification time, in UTC.
+        for filename in FILES:
+            os.utime(os.path.join(self.site, filename), (1e9, 1e9))
+        os.utime(os.path.join(self.site, 'stupid', '__main__.py'),
+                 (1.2e9, 1.2e9))
+        with patch.dict(os.environ):
+            os.environ.pop('SOURCE_DATE_EPOCH', None)
+            wheel = self._write(FILES)
+        with ZipFile(wheel) as zf:
+            self.assertEqual(
+                set(zinfo.date_time for zinfo in zf.infolist()),
+                set([(2008, 1, 10, 21, 20, 0)]))
+
+    def test_source_date_epoch(self):
+        with patch.dict(os.environ, SOURCE_DATE_EPOCH='1500000000'):
+            wheel = self._write(FILES)
+        with ZipFile(wheel) as zf:
+            self.assertEqual(
+                set(zinfo.date_time for zinfo in zf.infolist()),
+                set([(2017, 7, 14, 2, 40, 0)]))
+
+    def test_empty_source_date_epoch(self):
+        # An empty $SOURCE_DATE_EPOCH is ignored.
+        for filename in FILES:
+            os.utime(os.path.join(self.site, filename), (1e9, 1e9))
+        with patch.dict(os.environ, SOURCE_DATE_EPOCH=''):
+            wheel = self._write(FILES)
+        with ZipFile(wheel) as zf:
+            self.assertEqual(
+                set(zinfo.date_time for zinfo in zf.infolist()),
+                set([(2001, 9, 9, 1, 46, 40)]))
+
+    def test_bad_source_date_epoch(self):
+        # $SOURCE_DATE_EPOCH must be a whole number of seconds.
+        for epoch in ('1.5', 'yesterday'):
+            with patch.dict(os.environ, SOURCE_DATE_EPOCH=epoch):
+                self.assertRaises(ValueError, source_date_epoch)
+                self.assertRaises(ValueError, self._write, FILES)
+        with patch.dict(os.environ, SOURCE_DATE_EPOCH='1000000000'):
+            self.assertEqual(source_date_epoch(), 1000000000)
+
+    def test_permissions(self):
+        os.chmod(os.path.join(self.site, 'stupid', '__init__.py'), 0o600)
+        os.chmod(os.path.join(self.site, 'stupid', '__main__.py'), 0o700)
+        wheel = self._write(FILES)
+        with ZipFile(wheel) as zf:
+            modes = dict((zinfo.filename, zinfo.external_attr >> 16)
+                         for zinfo in zf.infolist())
+        self.assertEqual(modes['stupid/__init__.py'], 0o100644)
+        self.assertEqual(modes['stupid/__main__.py'], 0o100755)
+        self.assertEqual(modes['stupid-2.0.dist-info/RECORD'], 0o100644)
+
+    def test_compression(self):
+        sizes = {}
+        for compression, compress_type in (('stored', ZIP_STORED),
+                                           ('fast', ZIP_DEFLATED),
+                                           ('max', ZIP_DEFLATED)):
+            wheel = self._write(FILES, compression=compression)
+            with ZipFile(wheel) as zf:
+                self.assertEqual(
+                    set(zinfo.compress_type for zinfo in zf.infolist()),
+                    set([compress_type]))
+                self.assertIsNone(zf.testzip())
+                sizes[compression] = sum(
+                    zinfo.compress_size for zinfo in zf.infolist())
+        self.assertGreater(sizes['stored'], sizes['max'])
+
+    def _contents(self, filenames, **kws):
+        wheel = self._write(filenames, **kws)
+        with open(wheel, 'rb') as fp:
+            contents = fp.read()
+        os.remove(wheel)
+        return contents
+
+    def test_compress_threads(self):
+        # Compressing in threads gives exactly the same wheel.
+        for compression in ('stored', 'fast', 'default', 'max'):
+            self.assertEqual(
+                self._contents(FILES, compression=compression,
+                               compress_threads=3),
+                self._contents(FILES, compression=compression))
+
+    def test_compress_threads_in_flight(self):
+        # Files too big for the budget are streamed, in their place.
+        with open(os.path.join(self.site, 'stupid', 'big.txt'), 'w') as fp:
+            fp.write('big\n' * 1000)
+        filenames = list(FILES) + ['stupid/big.txt']
+        contents = self._contents(
+            filenames, compress_threads=2, max_in_flight_bytes=100)
+        self.assertEqual(contents, self._contents(filenames))
+        wheel = self._write(
+            filenames, compress_threads=2, max_in_flight_bytes=100)
+        with ZipFile(wheel) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist()[:3], [
+                'stupid/__init__.py',
+                'stupid/__main__.py',
+                'stupid/big.txt',
+                ])
+
+    def test_compile(self):
+        with open(os.path.join(self.site, 'stupid', 'py2.py'), 'w') as fp:
+            fp.write('print "Python 2 only"\n')
+        wheel = self._write(list(FILES) + ['stupid/py2.py'], compile_level=0)
+        init = compiled_name('stupid/__init__.py')
+        main = compiled_name('stupid/__main__.py')
+        with ZipFile(wheel) as zf:
+            names = zf.namelist()
+            record = zf.read('stupid-2.0.dist-info/RECORD').decode('utf-8')
+            bytecode = zf.read(init)
+        # The bytecode follows the sources, and what won't compile is left
+        # out.
+        self.assertEqual(names[:5], [
+            'stupid/__init__.py',
+            'stupid/__main__.py',
+            'stupid/py2.py',
+            init,
+            main,
+            ])
+        self.assertEqual(
+            sum(1 for name in names if name.endswith('.pyc')), 2)
+        self.assertIn('\n{},sha256='.format(init), record)
+        if sys.version_info.major >= 3:
+            from importlib.util import MAGIC_NUMBER
+            self.assertEqual(bytecode[:4], MAGIC_NUMBER)
+
+    def test_compile_pool(self):
+        # A shared pool is left running for the next wheel.
+        pool = compile_pool(2)
+        self.addCleanup(pool.join)
+        self.addCleanup(pool.terminate)
+        for i in range(2):
+            wheel = self._write(FILES, compile_level=0, compile_pool=pool)
+            with ZipFile(wheel) as zf:
+                self.assertIn(compiled_name('stupid/__init__.py'),
+                              zf.namelist())
+            os.remove(wheel)
+
+    @unittest.skipIf(sys.version_info.major == 2, 'Python 2 only has -O')
+    def test_compile_optimized(self):
+        wheel = self._write(FILES, compile_level=2)
+        with ZipFile(wheel) as zf:
+            names = zf.namelist()
+        self.assertIn(compiled_name('stupid/__init__.py', 2), names)
+        self.assertTrue(compiled_name('stupid/__init__.py', 2).endswith(
+            '.opt-2.pyc'))
+
+    def test_unknown_compile_level(self):
+        self.assertRaises(ValueError, WheelWriter, 'stupid', '2.0',
+                          self.site, compile_level=3)
+
+    def test_unknown_compression(self):
+        self.assertRaises(ValueError, WheelWriter, 'stupid', '2.0', self.site,
+                          compression='bzip2')
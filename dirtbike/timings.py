@@ -0,0 +1,107 @@
+"""Where the time goes when rewheeling."""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import threading
+
+from contextlib import contextmanager
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    # Python 2.
+    from time import time as clock
+
+
+class Timings(object):
+    """Accumulated time spent in each phase, and counts of things done.
+
+    Phases are named, and may be entered any number of times, from any
+    thread; the total time and the number of times each was entered are
+    kept.  Phases can nest, e.g. `hash` happens during `write`, so their
+    times don't add up to the total.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            # phase -> [seconds, calls]
+            self._phases = {}
+            self._counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Time the body of the `with` statement as part of phase `name`."""
+        start = clock()
+        try:
+            yield
+        finally:
+            self.add_time(name, clock() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        """Add `seconds` spent in phase `name`."""
+        with self._lock:
+            totals = self._phases.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+
+    def count(self, name, increment=1):
+        """Add `increment` to the counter `name`."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + increment
+
+    def as_dict(self):
+        """Return everything recorded, as a JSON serializable dictionary."""
+        with self._lock:
+            return dict(
+                phases=dict(
+                    (name, dict(seconds=seconds, calls=calls))
+                    for name, (seconds, calls) in self._phases.items()),
+                counters=dict(self._counters),
+                )
+
+    def merge(self, timings):
+        """Add in the `as_dict()` of some other `Timings`.
+
+        This is how the timings of worker processes get back to the parent.
+        """
+        for name, totals in timings['phases'].items():
+            self.add_time(name, totals['seconds'], totals['calls'])
+        for name, value in timings['counters'].items():
+            self.count(name, value)
+
+    def format_table(self):
+        """Return everything recorded, as a human readable table."""
+        timings = self.as_dict()
+        lines = ['{:<32} {:>10} {:>8}'.format('phase', 'seconds', 'calls')]
+        # Slowest first.
+        for seconds, name, calls in sorted(
+                ((totals['seconds'], name, totals['calls'])
+                 for name, totals in timings['phases'].items()),
+                reverse=True):
+            lines.append('{:<32} {:>10.3f} {:>8}'.format(name, seconds, calls))
+        lines.append('')
+        lines.append('{:<32} {:>10}'.format('counter', 'value'))
+        for name, value in sorted(timings['counters'].items()):
+            lines.append('{:<32} {:>10}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+_timings = None
+_timings_lock = threading.Lock()
+
+
+def get_timings():
+    """Return the process-wide timings, creating them if necessary."""
+    global _timings
+    with _timings_lock:
+        if _timings is None:
+            _timings = Timings()
+        return _timings
@@ -0,0 +1,659 @@
+"""Write wheels straight from the installed files."""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+    )
+
+
+import io
+import os
+import re
+import stat
+import time
+import zlib
+import uuid
+import errno
+import base64
+import hashlib
+import zipfile
+import textwrap
+
+from collections import deque
+from itertools import chain
+from email.parser import Parser
+from .bytecode import Compiler, check_level
+from .collector import installed_file
+from .timings import clock, get_timings
+from multiprocessing.pool import ThreadPool
+
+
+CHUNK_SIZE = 1024 * 1024
+# Zip files can't represent times before 1980.
+MIN_TIMESTAMP = 315532800
+# The number of threads hashing files for RECORD, or 0 to hash them in the
+# same thread that writes the wheel.
+HASH_THREADS = 2
+# The number of files whose hashes may still be being computed while later
+# files are written.
+MAX_IN_FLIGHT = 16
+# The number of threads compressing files, or 0 to compress them in the
+# same thread that writes the wheel.
+COMPRESS_THREADS = 0
+# The most bytes of files that may be being compressed, or waiting to be
+# written, at once.  Bigger files are streamed instead.
+MAX_IN_FLIGHT_BYTES = 64 * 1024 * 1024
+
+# How to compress the wheel's members, as (compress_type, compresslevel).  A
+# level of None means zlib's default.  Wheels are often installed moments after
+# they're built, on the same host, in which case compressing them is mostly
+# wasted effort.
+COMPRESSION = {
+    'stored': (zipfile.ZIP_STORED, None),
+    'fast': (zipfile.ZIP_DEFLATED, 1),
+    'default': (zipfile.ZIP_DEFLATED, None),
+    'max': (zipfile.ZIP_DEFLATED, 9),
+    }
+DEFAULT_COMPRESSION = 'default'
+
+# The Python tags of a wheel which works with either major version.
+UNIVERSAL = ('py2', 'py3')
+
+# Files in an installed .egg-info directory which are useless in a wheel.
+# This is the same set that bdist_wheel drops when converting an .egg-info
+# into a .dist-info.
+EGG_INFO_SKIP = frozenset([
+    'PKG-INFO',
+    'SOURCES.txt',
+    'not-zip-safe',
+    'requires.txt',
+    ])
+
+# Files in an installed .dist-info directory which describe the installation
+# rather than the distribution.  We write our own WHEEL and RECORD.
+DIST_INFO_SKIP = frozenset([
+    'INSTALLER',
+    'RECORD',
+    'RECORD.jws',
+    'RECORD.p7s',
+    'REQUESTED',
+    'WHEEL',
+    'direct_url.json',
+    ])
+
+
+def _escape(component):
+    # Escape a name or version for use in a wheel's file name, the same way
+    # bdist_wheel does.
+    return re.sub(r'[^A-Za-z0-9.]+', '_', component)
+
+
+def _compress(path, compress_type, level):
+    # Read, hash, checksum, and compress the file at `path` into memory, in
+    # a compression thread.  zlib and hashlib release the GIL for all of it.
+    start = clock()
+    digest = hashlib.sha256()
+    crc = size = 0
+    compressor = None
+    if compress_type == zipfile.ZIP_DEFLATED:
+        # Raw deflate, exactly as zipfile would do it.
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+            zlib.DEFLATED, -15)
+    chunks = []
+    with open(path, 'rb') as fp:
+        while True:
+            chunk = fp.read(CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            chunks.append(
+                chunk if compressor is None else compressor.compress(chunk))
+    if compressor is not None:
+        chunks.append(compressor.flush())
+    get_timings().add_time('compress', clock() - start)
+    return digest, crc & 0xFFFFFFFF, size, b''.join(chunks)
+
+
+def _can_write_compressed(zf):
+    # Writing compressed data straight into the archive relies on zipfile's
+    # internals, which are only like this from Python 3.6, and only work
+    # when the headers can be written before the data.
+    return getattr(zf, '_seekable', False) and all(
+        hasattr(zf, name) for name in ('start_dir', '_writecheck', '_lock'))
+
+
+def _write_compressed(zf, zinfo, data):
+    # Append a member whose `data` has already been compressed, as
+    # described by `zinfo`, giving exactly the same bytes as writing it with
+    # ZipFile.open(zinfo, 'w').
+    zip64 = zf._allowZip64 and zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+    if not zip64 and zinfo.file_size > zipfile.ZIP64_LIMIT:
+        raise zipfile.LargeZipFile('Filesize would require ZIP64 extensions')
+    with zf._lock:
+        zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        zf.fp.write(zinfo.FileHeader(zip64))
+        zf.fp.write(data)
+        zf.start_dir = zf.fp.tell()
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+
+
+class _Hasher(object):
+    # Compute a file's RECORD hash from its chunks.  With a thread pool, each
+    # chunk is hashed in the pool while the caller compresses it; hashlib
+    # and zlib both release the GIL on large buffers, so the two really do
+    # overlap.  Chunks of the same file must be hashed in order, so there is
+    # only ever one of them in flight per file.
+
+    def __init__(self, pool=None, digest=None):
+        self._pool = pool
+        self._digest = hashlib.sha256() if digest is None else digest
+        self._pending = None
+
+    def _update(self, chunk):
+        start = clock()
+        self._digest.update(chunk)
+        get_timings().add_time('hash', clock() - start)
+
+    def update(self, chunk):
+        if self._pool is None:
+            self._update(chunk)
+            return
+        self.wait()
+        self._pending = self._pool.apply_async(self._update, (chunk,))
+
+    def wait(self):
+        if self._pending is not None:
+            # get() rather than wait() so any exception is re-raised here.
+            self._pending.get()
+            self._pending = None
+
+    def record_hash(self):
+        self.wait()
+        return 'sha256=' + base64.urlsafe_b64encode(
+            self._digest.digest()).rstrip(b'=').decode('ascii')
+
+
+def _is_metadata(arcname):
+    return arcname.partition('/')[0].endswith(('.egg-info', '.dist-info'))
+
+
+def source_date_epoch():
+    """Return $SOURCE_DATE_EPOCH as an integer, or None if it isn't set.
+
+    An empty value is the same as not setting it at all.  Raises ValueError
+    if it isn't a whole number of seconds.
+    """
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if not epoch:
+        return None
+    try:
+        return int(epoch)
+    except ValueError:
+        raise ValueError(
+            '$SOURCE_DATE_EPOCH must be a whole number of seconds, '
+            'not {!r}'.format(epoch))
+
+
+def _timestamp(installed):
+    # Use $SOURCE_DATE_EPOCH if it's set, as reproducible builds expect.
+    # Otherwise, when the newest file was modified is as good a date for the
+    # distribution as any, and doesn't change until the files do.
+    epoch = source_date_epoch()
+    if epoch is not None:
+        return epoch
+    return max([info.mtime for info in installed] or [0])
+
+
+def _record_row(*fields):
+    # Quote fields the way the csv module would, without having to deal with
+    # its Python 2 unicode problems.
+    quoted = []
+    for field in fields:
+        if ',' in field or '"' in field:
+            field = '"{}"'.format(field.replace('"', '""'))
+        quoted.append(field)
+    return ','.join(quoted)
+
+
+def _requirements(requires):
+    # Convert an .egg-info's requires.txt into Provides-Extra and
+    # Requires-Dist headers.  Requirements come in sections headed with
+    # [extra], [:marker], or [extra:marker], and the first section has
+    # neither.
+    headers = []
+    extras = set()
+    extra = marker = None
+    for line in requires.splitlines():
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            extra, colon, marker = line[1:-1].partition(':')
+            extra = re.sub(r'[^A-Za-z0-9.-]+', '_', extra.strip()).lower()
+            marker = marker.strip()
+            continue
+        conditions = []
+        if marker:
+            conditions.append('({})'.format(marker) if extra else marker)
+        if extra:
+            conditions.append('extra == "{}"'.format(extra))
+            # Like bdist_wheel, only provide extras which require something.
+            if extra not in extras:
+                extras.add(extra)
+                headers.append(('Provides-Extra', extra))
+        if len(conditions) > 0:
+            line = '{}; {}'.format(line, ' and '.join(conditions))
+        headers.append(('Requires-Dist', line))
+    return headers
+
+
+def pkginfo_to_metadata(egg_info_path, pkg_info_path):
+    """Convert an .egg-info's PKG-INFO into wheel METADATA.
+
+    This does the same conversion as bdist_wheel, but without the
+    pkg_resources import that some versions of wheel's own implementation
+    drag in.
+    """
+    with io.open(pkg_info_path, encoding='utf-8') as fp:
+        pkg_info = Parser().parse(fp)
+    if 'Metadata-Version' in pkg_info:
+        pkg_info.replace_header('Metadata-Version', '2.1')
+    else:
+        pkg_info['Metadata-Version'] = '2.1'
+    # These are regenerated from requires.txt.
+    del pkg_info['Provides-Extra']
+    del pkg_info['Requires-Dist']
+    requires_path = os.path.join(egg_info_path, 'requires.txt')
+    if os.path.isfile(requires_path):
+        with io.open(requires_path, encoding='utf-8') as fp:
+            for header, value in _requirements(fp.read()):
+                pkg_info[header] = value
+    # The long description goes in the message body.
+    description = pkg_info['Description']
+    if description:
+        lines = description.splitlines()
+        pkg_info.set_payload('\n'.join((
+            lines[0].lstrip(),
+            textwrap.dedent('\n'.join(lines[1:])),
+            '\n')))
+        del pkg_info['Description']
+    return pkg_info
+
+
+class WheelWriter(object):
+    """Build a wheel directly from a distribution's installed files.
+
+    Rather than copying everything into a staging directory and letting
+    bdist_wheel read it back, hash it, and zip it, each file is read exactly
+    once, hashed as it is compressed into the wheel.  The .dist-info metadata
+    is generated here too, from whatever installed .egg-info or .dist-info
+    metadata the distribution has.
+
+    The wheel is universal, unless `tags` says which Python versions it's
+    for, e.g. ('py2',).  The files are hashed in a pool of `hash_threads`
+    threads, started and stopped by `write()`.  Alternatively, `pool` is a
+    `ThreadPool` shared with other writers, which is left running.
+
+    `metadata_dir` is the name of the distribution's own .egg-info or
+    .dist-info, from which the wheel's .dist-info is made.  Any other
+    distribution's metadata among the files is left out.  By default, it's
+    the one named after the distribution, or failing that, the only one.
+
+    If `compile_level` isn't None, the wheel includes bytecode for this
+    interpreter, compiled from its sources at that optimization level, in
+    `compile_pool` if it's given, a pool from `compile_pool()` shared with
+    other writers.
+
+    With `compress_threads` greater than 0, that many threads each read,
+    hash, and compress whole files into memory, and the files are added to
+    the wheel in order as they're done, so it's the same wheel either way.
+    At most `max_in_flight_bytes` of them, before compression, are held at
+    once.  Before Python 3.6, files are always compressed one at a time.
+    """
+
+    def __init__(self, name, version, location, hash_threads=HASH_THREADS,
+                 compression=DEFAULT_COMPRESSION, pool=None,
+                 tags=UNIVERSAL, compile_level=None,
+                 compress_threads=COMPRESS_THREADS,
+                 max_in_flight_bytes=MAX_IN_FLIGHT_BYTES,
+                 compile_pool=None, metadata_dir=None):
+        if compression not in COMPRESSION:
+            raise ValueError('Unknown compression: {}'.format(compression))
+        if compile_level is not None:
+            check_level(compile_level)
+        self.name = name
+        # bdist_wheel has the same fallback for distributions, such as those
+        # found by importing them, for which we have no version.
+        self.version = '0.0.0' if version is None else version
+        self.location = location
+        self.hash_threads = hash_threads
+        self.compression = compression
+        self.tags = tuple(tags)
+        self.compile_level = compile_level
+        self.compile_pool = compile_pool
+        self.metadata_dir = metadata_dir
+        self.compress_threads = compress_threads
+        self.max_in_flight_bytes = max_in_flight_bytes
+        # Iterables of (path, info) pairs, not consumed until write().
+        self._sources = []
+        self._shared_pool = pool
+        self._pool = None
+        self._in_flight = deque()
+        # Every member's modification time, once write() has decided it.
+        self._date_time = None
+
+    @property
+    def filename(self):
+        """The file name of the wheel."""
+        return '{}-{}-{}-none-any.whl'.format(
+            _escape(self.name), _escape(self.version), '.'.join(self.tags))
+
+    @property
+    def dist_info(self):
+        """The name of the wheel's .dist-info directory."""
+        return '{}-{}.dist-info'.format(
+            _escape(self.name), _escape(self.version))
+
+    def add(self, path, info=None):
+        """Add the file at `path`, which must be inside `location`.
+
+        If the file has already been stat'ed, `info` is its `InstalledFile`.
+        """
+        if len(self._sources) == 0 or not isinstance(self._sources[-1], list):
+            self._sources.append([])
+        self._sources[-1].append((path, info))
+
+    def add_files(self, installed):
+        """Add every `InstalledFile` in the iterable `installed`.
+
+        `installed` isn't consumed until `write()`, which lists every file,
+        so that they can be sorted into the same order however they were
+        found.  Only their names and stats are kept; the files themselves
+        are read one at a time, as they're written.
+        """
+        self._sources.append((info.path, info) for info in installed)
+
+    def _members(self):
+        for path, info in chain.from_iterable(self._sources):
+            arcname = os.path.relpath(path, self.location)
+            yield arcname.replace(os.sep, '/'), path, info
+
+    def _zinfo(self, arcname, mode):
+        zinfo = zipfile.ZipInfo(arcname, self._date_time)
+        # Only whether the file is executable survives, so that the umask of
+        # whoever installed it doesn't matter.
+        zinfo.external_attr = (
+            stat.S_IFREG | (0o755 if mode & 0o111 else 0o644)) << 16
+        zinfo.create_system = 3
+        zinfo.compress_type, level = COMPRESSION[self.compression]
+        if level is not None:
+            # Before Python 3.7 this is ignored, and the level is zlib's
+            # default.
+            zinfo._compresslevel = level
+        return zinfo
+
+    def _write_file(self, zf, arcname, path, info=None):
+        if info is None:
+            info = installed_file(path)
+        zinfo = self._zinfo(arcname, info.mode)
+        zinfo.file_size = info.size
+        hasher = _Hasher(self._pool)
+        size = 0
+        with open(path, 'rb') as src:
+            try:
+                dst = zf.open(zinfo, 'w')
+            except (TypeError, ValueError, RuntimeError):
+                # Before Python 3.6 members can't be written incrementally,
+                # so the best we can do is read the file only once.
+                data = src.read()
+                hasher.update(data)
+                size = len(data)
+                zf.writestr(zinfo, data)
+            else:
+                with dst:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if len(chunk) == 0:
+                            break
+                        hasher.update(chunk)
+                        size += len(chunk)
+                        dst.write(chunk)
+        get_timings().count('bytes_read', size)
+        # Move on to the next file without waiting for this one's hash, but
+        # don't let an unbounded number of chunks pile up in the pool.
+        self._in_flight.append(hasher)
+        if len(self._in_flight) > MAX_IN_FLIGHT:
+            self._in_flight.popleft().wait()
+        return arcname, hasher, size
+
+    def _write_files(self, zf, files):
+        # Write the (arcname, path, info) triples in `files`, in order,
+        # returning their records.
+        if self.compress_threads == 0 or not _can_write_compressed(zf):
+            return [self._write_file(zf, arcname, path, info)
+                    for arcname, path, info in files]
+        records = []
+        pool = ThreadPool(self.compress_threads)
+        # (arcname, info, result) for the files being compressed, in the
+        # order they must be written.
+        pending = deque()
+        in_flight = 0
+
+        def write_next():
+            arcname, info, result = pending.popleft()
+            digest, crc, size, data = result.get()
+            zinfo = self._zinfo(arcname, info.mode)
+            zinfo.file_size = size
+            zinfo.compress_size = len(data)
+            zinfo.CRC = crc
+            _write_compressed(zf, zinfo, data)
+            get_timings().count('bytes_read', size)
+            records.append((arcname, _Hasher(digest=digest), size))
+            return info.size
+
+        compress_type, level = COMPRESSION[self.compression]
+        try:
+            for arcname, path, info in files:
+                if info.size > self.max_in_flight_bytes:
+                    # Too big to hold in memory, so stream it once everything
+                    # before it has been written.
+                    while len(pending) > 0:
+                        in_flight -= write_next()
+                    records.append(self._write_file(zf, arcname, path, info))
+                    continue
+                while in_flight + info.size > self.max_in_flight_bytes:
+                    in_flight -= write_next()
+                pending.append((arcname, info, pool.apply_async(
+                    _compress, (path, compress_type, level))))
+                in_flight += info.size
+            while len(pending) > 0:
+                write_next()
+        except BaseException:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+        return records
+
+    def _write_bytes(self, zf, arcname, data):
+        zinfo = self._zinfo(arcname, 0o644)
+        zf.writestr(zinfo, data)
+        hasher = _Hasher()
+        hasher.update(data)
+        return arcname, hasher, len(data)
+
+    def _metadata(self, pkg_info):
+        if pkg_info is None:
+            # This happens when we're rewheeling something without any
+            # metadata, e.g. a stdlib backport or one of the packages Debian
+            # splits out of a bigger project, such as pkg_resources.
+            return (
+                'Metadata-Version: 2.1\n'
+                'Name: {}\n'
+                'Version: {}\n').format(self.name, self.version)
+        egg_info_path, pkg_info_path = pkg_info
+        return pkginfo_to_metadata(egg_info_path, pkg_info_path).as_string()
+
+    def _wheel(self):
+        lines = [
+            'Wheel-Version: 1.0',
+            'Generator: dirtbike',
+            'Root-Is-Purelib: true',
+            ]
+        lines.extend('Tag: {}-none-any'.format(tag) for tag in self.tags)
+        return '\n'.join(lines) + '\n'
+
+    def _own_metadata(self, members):
+        # Return the name of the distribution's own metadata directory, out
+        # of those in `members`, or None.  A Debian package can ship other
+        # distributions' metadata too, e.g. a plugin's, which would clobber
+        # this one's in the wheel's single .dist-info.
+        tops = sorted(set(
+            arcname.partition('/')[0] for arcname, path, info in members
+            if _is_metadata(arcname)))
+        if self.metadata_dir is not None:
+            return self.metadata_dir if self.metadata_dir in tops else None
+        name = _escape(self.name).lower()
+        for top in tops:
+            if _escape(top.split('-')[0]).lower() == name:
+                return top
+        return tops[0] if len(tops) == 1 else None
+
+    def _write(self, zf, members, compiler=None):
+        records = []
+        regular = []
+        metadata_members = []
+        metadata = pkg_info = None
+        own = self._own_metadata(members)
+        for arcname, path, info in members:
+            top, slash, rest = arcname.partition('/')
+            if _is_metadata(arcname) and top != own:
+                get_timings().count('foreign_metadata_skipped')
+                continue
+            if top.endswith('.egg-info'):
+                if len(rest) == 0:
+                    # Debian ships single file .egg-infos for distutils
+                    # projects.
+                    pkg_info = (path, path)
+                elif rest == 'PKG-INFO':
+                    pkg_info = (os.path.dirname(path), path)
+                elif rest == 'dependency_links.txt':
+                    # This is only worth keeping if it isn't empty.
+                    with open(path, 'rb') as fp:
+                        if len(fp.read().strip()) > 0:
+                            metadata_members.append((rest, path, info))
+                elif rest not in EGG_INFO_SKIP:
+                    metadata_members.append((rest, path, info))
+            elif top.endswith('.dist-info'):
+                if rest == 'METADATA':
+                    with open(path, 'rb') as fp:
+                        metadata = fp.read()
+                elif rest not in DIST_INFO_SKIP:
+                    metadata_members.append((rest, path, info))
+            else:
+                regular.append((arcname, path, info))
+        records.extend(self._write_files(zf, regular))
+        if compiler is not None:
+            # The bytecode has been compiling while the sources were written.
+            records.extend(self._write_files(zf, [
+                (arcname, path, installed_file(path))
+                for arcname, path in compiler.results()]))
+        # The .dist-info goes at the end of the archive, as the wheel spec
+        # recommends, with RECORD last of all.
+        # These are generated, so an installed file with the same name, e.g.
+        # an .egg-info's RECORD, mustn't go in as well.
+        written = set(['METADATA', 'WHEEL', 'RECORD'])
+        for rest, path, info in metadata_members:
+            if rest in written:
+                continue
+            written.add(rest)
+            records.append(self._write_file(
+                zf, '{}/{}'.format(self.dist_info, rest), path, info))
+        if metadata is None:
+            metadata = self._metadata(pkg_info).encode('utf-8')
+        records.append(self._write_bytes(
+            zf, '{}/METADATA'.format(self.dist_info), metadata))
+        records.append(self._write_bytes(
+            zf, '{}/WHEEL'.format(self.dist_info),
+            self._wheel().encode('utf-8')))
+        # The members' hashes may still be being computed, but they go into
+        # RECORD in the same order as the members went into the archive.
+        rows = [
+            _record_row(arcname, hasher.record_hash(), str(size))
+            for arcname, hasher, size in records
+            ]
+        record_name = '{}/RECORD'.format(self.dist_info)
+        rows.append(_record_row(record_name, '', ''))
+        self._write_bytes(
+            zf, record_name, ('\n'.join(rows) + '\n').encode('utf-8'))
+
+    def write(self, directory):
+        """Write the wheel into `directory`, returning its path.
+
+        The wheel is written under a temporary name and renamed into place
+        when complete, so a failed build never leaves a truncated wheel
+        behind.
+        """
+        path = os.path.join(directory, self.filename)
+        # Don't use mkstemp() because its 0600 mode would stick to the wheel.
+        tmpfile = os.path.join(
+            directory, '.{}.{}'.format(uuid.uuid4().hex, self.filename))
+        # Wheels are reproducible: the same files give the same bytes, no
+        # matter what order they were found in, or when they were written.
+        members = []
+        seen = set()
+        with get_timings().phase('collect'):
+            # Files added with add_files() are only found now.
+            for arcname, source, info in self._members():
+                # RECORD files and dpkg's lists can name the same file
+                # twice, but a zip file mustn't have two members with the
+                # same name.
+                if arcname in seen:
+                    continue
+                seen.add(arcname)
+                if info is None:
+                    info = installed_file(source)
+                members.append((arcname, source, info))
+        members.sort(key=lambda member: member[0])
+        self._date_time = time.gmtime(max(
+            _timestamp([info for arcname, path, info in members]),
+            MIN_TIMESTAMP))[:6]
+        compiler = None
+        if self.compile_level is not None:
+            compiler = Compiler(self.compile_level, pool=self.compile_pool)
+            compiler.start([
+                (arcname, path) for arcname, path, info in members
+                if arcname.endswith('.py') and not _is_metadata(arcname)])
+        if self._shared_pool is not None:
+            self._pool = self._shared_pool
+        elif self.hash_threads > 0:
+            self._pool = ThreadPool(self.hash_threads)
+        try:
+            with get_timings().phase('write'), open(tmpfile, 'wb') as fp:
+                with zipfile.ZipFile(fp, 'w', zipfile.ZIP_DEFLATED) as zf:
+                    self._write(zf, members, compiler)
+            os.rename(tmpfile, path)
+        except BaseException:
+            try:
+                os.remove(tmpfile)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+            raise
+        finally:
+            self._in_flight.clear()
+            if self._pool is not self._shared_pool:
+                self._pool.close()
+                self._pool.join()
+            self._pool = None
+            if compiler is not None:
+                compiler.close()
+        return path
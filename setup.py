@@ -11,9 +11,6 @@ setup(name='dirtbike',
       author_email='asheesh@asheesh.org',
       url='https://github.com/paulproteus/dirtbike',
       packages=['dirtbike'],
-      install_requires=[
-          'wheel',
-      ],
       entry_points={
           'console_scripts': [
               'dirtbike = dirtbike.__main__:main',